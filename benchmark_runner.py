@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import json
+import os
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from src.cv_helpers import MultiTimeSeriesDateSplit
+from src.inference_helpers import predict_future
+from src.ml_metrics import lgbm_smape
+from src.synthetic_data_helpers import make_synthetic_sales
+from src.utils import score_model
+
+PROJ_ROOT_DIR = os.getcwd()
+benchmark_dir = os.path.join(PROJ_ROOT_DIR, "data", "processed", "benchmarks")
+baseline_path = os.path.join(benchmark_dir, "baseline.json")
+latest_path = os.path.join(benchmark_dir, "latest.json")
+
+# stores x items x days
+default_sizes = ["10x50x1096", "20x100x1096", "50x200x1096"]
+
+bench_dict = dict(
+    N_SPLITS=2,
+    HORIZON=90,
+    GAP=90,
+    lags_range=[90, 120],
+    window_size=180,
+    used_columns=["store", "item", "date", "sales"],
+    categ_fea=["store", "item"],
+    model_params={
+        "metric": {"mae"},
+        "num_leaves": 31,
+        "learning_rate": 0.05,
+        "verbose": -1,
+    },
+    model_fit_params={"num_boost_round": 100, "early_stopping_rounds": 20},
+)
+
+
+def summarize_stages(memory_report: List[Dict]) -> Dict:
+    """Add up stage records over folds: times and rows are summed, the peak
+    memory is the largest peak of the stage."""
+    df = pd.DataFrame.from_records(memory_report)
+    summary = df.groupby("stage", sort=False).agg(
+        wall_s=("wall_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_mb=("peak_mb", "max"),
+        rows_in=("rows_in", "sum"),
+    )
+    return summary.to_dict(orient="index")
+
+
+def run_size(size: str, params: Dict) -> Dict:
+    """Time and memory-profile every stage of score_model and predict_future
+    on synthetic data of one stores x items x days size."""
+    n_stores, n_items, n_days = [int(n) for n in size.split("x")]
+    start_time = perf_counter()
+    data = make_synthetic_sales(n_stores, n_items, n_days)
+    stages = {
+        "generate": {
+            "wall_s": perf_counter() - start_time,
+            "rows_in": 0,
+            "rows_out": len(data),
+        }
+    }
+    first_date = data.index.get_level_values("date").min()
+    lags = np.arange(*params["lags_range"])
+    shared_args = [
+        lags,
+        params["window_size"],
+        params["used_columns"],
+        params["categ_fea"],
+        first_date,
+        params["GAP"],
+        params["HORIZON"],
+    ]
+    cv = MultiTimeSeriesDateSplit(
+        num_folds=params["N_SPLITS"],
+        forecast_horizon=params["HORIZON"],
+        look_ahead_length=params["GAP"] + 1,
+    )
+    cv_report = []
+    score_model(
+        data,
+        cv,
+        *shared_args,
+        params["model_params"],
+        lgbm_smape,
+        params["model_fit_params"],
+        memory_report=cv_report,
+    )
+    stages.update(
+        {f"cv_{k}": v for k, v in summarize_stages(cv_report).items()}
+    )
+    pred_report = []
+    predict_future(
+        0,
+        data,
+        *shared_args,
+        pd.DataFrame(),
+        params["model_params"],
+        lgbm_smape,
+        params["model_fit_params"],
+        memory_report=pred_report,
+    )
+    stages.update(
+        {f"pred_{k}": v for k, v in summarize_stages(pred_report).items()}
+    )
+    return {"rows": len(data), "stages": stages}
+
+
+def compare_to_baseline(
+    results: Dict, baseline: Dict, tolerance: float = 1.25
+) -> pd.DataFrame:
+    """Compare stage wall times with the baseline, flagging stages that got
+    slower than tolerance x the baseline time."""
+    rows = []
+    for size, result in results.items():
+        for stage, record in result["stages"].items():
+            base_record = baseline.get(size, {}).get("stages", {}).get(stage)
+            base_wall_s = (
+                np.nan if base_record is None else base_record["wall_s"]
+            )
+            rows.append(
+                {
+                    "size": size,
+                    "stage": stage,
+                    "wall_s": record["wall_s"],
+                    "baseline_wall_s": base_wall_s,
+                    "ratio": record["wall_s"] / base_wall_s,
+                    "peak_mb": record.get("peak_mb", np.nan),
+                }
+            )
+    df = pd.DataFrame.from_records(rows)
+    df["regression"] = df["ratio"] > tolerance
+    return df
+
+
+def run_benchmarks(
+    sizes: List[str],
+    params: Dict = bench_dict,
+    save_baseline: bool = False,
+    tolerance: float = 1.25,
+) -> pd.DataFrame:
+    """Benchmark the pipeline stages at several data sizes.
+    Usage
+    -----
+    > python3 benchmark_runner.py --sizes 10x50x1096 100x500x1096
+    > python3 benchmark_runner.py --save-baseline
+    """
+    results = {size: run_size(size, params) for size in sizes}
+    os.makedirs(benchmark_dir, exist_ok=True)
+    with open(latest_path, "w") as f:
+        json.dump(results, f, indent=2)
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    df = compare_to_baseline(results, baseline, tolerance)
+    with pd.option_context(
+        "display.width",
+        120,
+        "display.max_rows",
+        None,
+        "display.max_columns",
+        None,
+    ):
+        print(df.round(3))
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=default_sizes,
+        help="data sizes as <stores>x<items>x<days>",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store this run as the baseline for later runs",
+    )
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+    run_benchmarks(args.sizes, bench_dict, args.save_baseline, args.tolerance)
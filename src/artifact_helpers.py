@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+
+import joblib
+import lightgbm as lgb
+import sklearn
+
+MODEL_FILE_NAME = "model.txt"
+BUNDLE_FILE_NAME = "bundle.joblib"
+
+
+def save_artifacts(
+    artifact_dir,
+    model,
+    fitted_preprocessor,
+    feature_cols,
+    feature_config,
+    train_end_date,
+):
+    """Save everything needed to forecast without retraining.
+
+    The booster is saved in LightGBM's text format; the fitted
+    preprocessors, the feature column order and the feature config
+    (lags, window_size, used_columns, categ_fea, first_date, gap, horizon,
+    compact, preprocessing) go into a joblib bundle next to it.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    model.save_model(os.path.join(artifact_dir, MODEL_FILE_NAME))
+    bundle = {
+        "fitted_preprocessor": fitted_preprocessor,
+        "feature_cols": feature_cols,
+        "feature_config": feature_config,
+        "train_end_date": train_end_date,
+        "versions": {
+            "lightgbm": lgb.__version__,
+            "scikit-learn": sklearn.__version__,
+        },
+    }
+    joblib.dump(bundle, os.path.join(artifact_dir, BUNDLE_FILE_NAME))
+
+
+def load_artifacts(artifact_dir):
+    bundle = joblib.load(os.path.join(artifact_dir, BUNDLE_FILE_NAME))
+    if bundle["versions"]["scikit-learn"] != sklearn.__version__:
+        print(
+            "Preprocessors were saved with scikit-learn "
+            f"{bundle['versions']['scikit-learn']}, "
+            f"loading with {sklearn.__version__}"
+        )
+    bundle["model"] = lgb.Booster(
+        model_file=os.path.join(artifact_dir, MODEL_FILE_NAME)
+    )
+    return bundle
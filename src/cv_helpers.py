@@ -8,19 +8,49 @@ import numpy as np
 import pandas as pd
 
 
-def show_cv_dates(fold_num, train_df, test_df, time_taken):
-    train_dates = train_df.index.get_level_values("date")
+def get_level_counts(df, level):
+    """Return the values of an index level and the number of rows per value,
+    counted from the level codes."""
+    level_num = df.index.names.index(level)
+    codes = df.index.codes[level_num]
+    counts = np.bincount(
+        codes[codes >= 0], minlength=len(df.index.levels[level_num])
+    )
+    return [df.index.levels[level_num], counts]
+
+
+def show_cv_dates(
+    fold_num, train_df, test_df, time_taken, gap=None, full_audit=False
+):
+    """Print the train, gap and test periods of a fold.
+
+    Overlap and per-series sizes are checked from the index codes, and the
+    number of days between train and test against gap, if given. Set
+    full_audit=True to also check that no row of train_df and test_df is
+    duplicated, which compares every column of every row.
+    """
+    dates_count = {}
+    series_count = {}
+    for split, df in zip(["train", "test"], [train_df, test_df]):
+        dates, counts = get_level_counts(df, "date")
+        dates_count[split] = dates[counts > 0]
+        _, counts = get_level_counts(df, "symbol")
+        # Number of rows per series shared by most series
+        series_count[split] = pd.Series(counts[counts > 0]).value_counts()
+    train_dates = dates_count["train"]
+    test_dates = dates_count["test"]
+    assert train_dates.max() < test_dates.min()
+    if full_audit:
+        df = pd.concat([train_df.reset_index(), test_df.reset_index()])
+        assert len(df) == len(df.drop_duplicates())
     gap_start = train_dates.max() + pd.DateOffset(days=1)
-    test_dates = test_df.index.get_level_values("date")
     gap_end = test_dates.min() - pd.DateOffset(days=1)
-    df = train_df.reset_index().append(test_df.reset_index())
-    n = len(df)
-    assert n == len(df.drop_duplicates())
-    test_size = test_df.groupby(level="symbol").size().value_counts().index[0]
-    train_split_size = (
-        train_df.groupby(level="symbol").size().value_counts().index[0]
-    )
+    test_size = series_count["test"].index[0]
+    train_split_size = series_count["train"].index[0]
     gap_size = len(pd.date_range(gap_start.date(), gap_end.date()))
+    assert (
+        gap is None or gap_size == gap
+    ), f"Fold {fold_num} has a {gap_size}-day gap, expected {gap}"
     print(
         f"{fold_num}|"
         f"{train_dates.min().date()} - {train_dates.max().date()} "
@@ -79,10 +109,25 @@ class MultiTimeSeriesDateSplit:
         fold_indexes : tuple
             Returns folds in the cross-validator.
         """
-        unique_periods = X.index.get_level_values("date").unique()
-        periods = sorted(unique_periods, reverse=True)
+        # Integer date codes, 0 for the earliest date
+        date_codes, unique_periods = pd.factorize(
+            X.index.get_level_values("date"), sort=True
+        )
+        # Position k in the newest-first dates is code n - 1 - k
+        period_codes = np.arange(len(unique_periods))[::-1]
+        is_sorted = bool(np.all(date_codes[1:] >= date_codes[:-1]))
+
+        def get_positions(after_code, last_code):
+            """Row positions with after_code < date code <= last_code."""
+            if is_sorted:
+                start, stop = np.searchsorted(
+                    date_codes, [after_code, last_code], side="right"
+                )
+                return np.arange(start, stop)
+            return np.flatnonzero(
+                (date_codes > after_code) & (date_codes <= last_code)
+            )
 
-        fold_indexes = []
         for fold_num in range(self.num_folds):
             test_end_idx = fold_num * self.forecast_horizon
             test_start_idx = test_end_idx + self.forecast_horizon
@@ -92,37 +137,13 @@ class MultiTimeSeriesDateSplit:
                 train_start_idx = (
                     train_end_idx + self.train_length + self.lookahead_len - 1
                 )
-                fold_indexes.append(
-                    [
-                        train_start_idx,
-                        train_end_idx,
-                        test_start_idx,
-                        test_end_idx,
-                    ]
-                )
+                train_after = period_codes[train_start_idx]
             else:
                 # Expanding Window
-                fold_indexes.append(
-                    [train_end_idx, test_start_idx, test_end_idx]
-                )
-
-        df_dates = X.reset_index()[["date"]]
-        for cfg in fold_indexes:
-            # Masks
-            if self.train_length:
-                train_start, train_end, test_start, test_end = cfg
-                train_start_mask = df_dates["date"] > periods[train_start]
-            else:
-                train_end, test_start, test_end = cfg
-            train_end_mask = df_dates["date"] <= periods[train_end]
-            test_start_mask = df_dates["date"] > periods[test_start]
-            test_end_mask = df_dates["date"] <= periods[test_end]
-            # Slice
-            if self.train_length:
-                train_mask = train_start_mask & train_end_mask
-                train_idx = df_dates[train_mask].index
-            else:
-                train_idx = df_dates[train_end_mask].index
-            test_idx = df_dates[test_start_mask & test_end_mask].index
+                train_after = -1
+            train_idx = get_positions(train_after, period_codes[train_end_idx])
+            test_idx = get_positions(
+                period_codes[test_start_idx], period_codes[test_end_idx]
+            )
             fold_indexes = (train_idx, test_idx)
             yield fold_indexes
@@ -2,36 +2,273 @@
 # -*- coding: utf-8 -*-
 
 
+import io
+import json
 import os
-from io import StringIO
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azure.core import MatchConditions
 from azure.storage.blob import BlobServiceClient
 
 
-def az_load_data(
-    blob_dict_inputs,
-    az_storage_container_name,
-    parse_dates=["date"],
-    dict_keys_to_return=["train", "test"],
-):
-    conn_str = (
+class ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of bytes chunks, so that
+    pd.read_csv() can parse a blob while it is being downloaded."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset == len(self._buffer):
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+            self._offset = 0
+        # The rest of a chunk is read from an offset, not copied again
+        start = self._offset
+        n = min(len(b), len(self._buffer) - start)
+        end = start + n
+        b[:n] = self._buffer[start:end]
+        self._offset = end
+        return n
+
+
+def get_az_conn_str():
+    # Full connection string takes precedence, e.g. for the Azurite emulator
+    conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if conn_str:
+        return conn_str
+    return (
         "DefaultEndpointsProtocol=https;"
         f"AccountName={os.getenv('AZURE_STORAGE_ACCOUNT')};"
         f"AccountKey={os.getenv('AZURE_STORAGE_KEY')};"
         f"EndpointSuffix={os.getenv('ENDPOINT_SUFFIX')}"
     )
-    blob_service_client = BlobServiceClient.from_connection_string(
-        conn_str=conn_str
+
+
+def az_download_blob_cached(blob_client, cache_path):
+    """Download a blob to cache_path, unless the cached copy has the same
+    ETag and last-modified time as the blob. The blob is written in chunks
+    and never held in memory as a whole."""
+    meta_path = f"{cache_path}.meta.json"
+    props = blob_client.get_blob_properties()
+    blob_meta = {"etag": props.etag, "last_modified": str(props.last_modified)}
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == blob_meta:
+                return cache_path
+
+    # Blob names may contain "/", i.e. subdirectories of the cache
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Fails instead of caching a blob that changed after the ETag check
+    downloader = blob_client.download_blob(
+        etag=props.etag, match_condition=MatchConditions.IfNotModified
+    )
+    with NamedTemporaryFile(
+        dir=os.path.dirname(cache_path), suffix=".tmp", delete=False
+    ) as f:
+        try:
+            for chunk in downloader.chunks():
+                f.write(chunk)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, cache_path)
+    with open(meta_path, "w") as f:
+        json.dump(blob_meta, f)
+    return cache_path
+
+
+def az_read_blob(
+    blob_service_client,
+    az_storage_container_name,
+    az_blob_name,
+    parse_dates,
+    cache_dir=None,
+):
+    blob_client = blob_service_client.get_blob_client(
+        container=az_storage_container_name, blob=az_blob_name
     )
+    if cache_dir is None:
+        downloader = blob_client.download_blob()
+        stream = io.BufferedReader(ChunkStream(downloader.chunks()))
+        return pd.read_csv(stream, parse_dates=parse_dates)
+    cache_path = az_download_blob_cached(
+        blob_client,
+        os.path.join(cache_dir, az_storage_container_name, az_blob_name),
+    )
+    return pd.read_csv(cache_path, parse_dates=parse_dates)
+
 
+def az_load_data(
+    blob_dict_inputs,
+    az_storage_container_name,
+    parse_dates=["date"],
+    dict_keys_to_return=["train", "test"],
+    cache_dir=None,
+    local_dir=None,
+    max_workers=None,
+    parquet_dir=None,
+):
+    """Load CSV blobs into DataFrames.
+
+    Only the blobs mapped to dict_keys_to_return are fetched, concurrently.
+    Blobs are streamed into the CSV parser in chunks. If cache_dir is given,
+    a local copy of each blob is kept and only downloaded again when its
+    ETag changes. If local_dir is given, blobs are read from
+    <local_dir>/<blob name> and Azure is not contacted at all. Set
+    AZURE_STORAGE_CONNECTION_STRING to use an emulator such as Azurite.
+
+    If parquet_dir is given, every CSV is converted once into a Parquet
+    dataset <parquet_dir>/<file type> (see write_partitioned_parquet()),
+    which later calls read instead of the CSV.
+    """
+    blobs_to_load = {
+        az_blob_name: file_type
+        for az_blob_name, file_type in blob_dict_inputs.items()
+        if file_type in dict_keys_to_return
+    }
     df_dict = {}
-    for az_blob_name, file_type in blob_dict_inputs.items():
-        blob_client = blob_service_client.get_blob_client(
-            container=az_storage_container_name, blob=az_blob_name
+    if parquet_dir is not None:
+        for az_blob_name, file_type in list(blobs_to_load.items()):
+            dataset_dir = os.path.join(parquet_dir, file_type)
+            if os.path.isdir(dataset_dir):
+                # In the row order of the CSV files
+                df_dict[file_type] = (
+                    load_partitioned_parquet(dataset_dir)
+                    .sort_values(["store", "item"] + parse_dates)
+                    .reset_index(drop=True)
+                )
+                del blobs_to_load[az_blob_name]
+
+    if local_dir is not None:
+        df_dict.update(
+            {
+                file_type: pd.read_csv(
+                    os.path.join(local_dir, az_blob_name),
+                    parse_dates=parse_dates,
+                )
+                for az_blob_name, file_type in blobs_to_load.items()
+            }
         )
-        blobstring = blob_client.download_blob().content_as_text()
-        df_dict[file_type] = pd.read_csv(
-            StringIO(blobstring), parse_dates=parse_dates
+    elif blobs_to_load:
+        blob_service_client = BlobServiceClient.from_connection_string(
+            conn_str=get_az_conn_str()
         )
+        with ThreadPoolExecutor(
+            max_workers=max_workers or len(blobs_to_load)
+        ) as executor:
+            futures = {
+                file_type: executor.submit(
+                    az_read_blob,
+                    blob_service_client,
+                    az_storage_container_name,
+                    az_blob_name,
+                    parse_dates,
+                    cache_dir,
+                )
+                for az_blob_name, file_type in blobs_to_load.items()
+            }
+            df_dict.update(
+                {
+                    file_type: future.result()
+                    for file_type, future in futures.items()
+                }
+            )
+
+    if parquet_dir is not None:
+        for file_type in blobs_to_load.values():
+            write_partitioned_parquet(
+                df_dict[file_type], os.path.join(parquet_dir, file_type)
+            )
     return [df_dict[k] for k in dict_keys_to_return]
+
+
+def write_partitioned_parquet(
+    df, root_dir, date_col="date", partition_by="year", compression="zstd"
+):
+    """Write raw sales once to a compressed Parquet dataset, partitioned by
+    year (derived from date_col) or by another column such as store.
+
+    Rows are sorted by date inside each partition so that row-group
+    statistics let readers skip data outside a requested date range.
+    Partitions of root_dir that df has rows for are replaced, others are
+    kept, so a rerun does not duplicate rows.
+    """
+    if partition_by == "year":
+        df = df.assign(year=df[date_col].dt.year)
+    df = df.sort_values([partition_by, date_col])
+    # write_to_dataset() adds uniquely named files to existing partitions
+    for value in df[partition_by].unique():
+        partition_dir = os.path.join(root_dir, f"{partition_by}={value}")
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=root_dir,
+        partition_cols=[partition_by],
+        compression=compression,
+    )
+
+
+def load_partitioned_parquet(
+    root_dir,
+    columns=None,
+    start_date=None,
+    end_date=None,
+    date_col="date",
+    memory_map=True,
+):
+    """Read selected columns of a dataset written by
+    write_partitioned_parquet(), pushing the date range down to the files.
+
+    Year partitions outside [start_date, end_date] are not opened and row
+    groups outside it are skipped using their statistics.
+    """
+    filters = []
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters += [
+            (date_col, ">=", start_date),
+            ("year", ">=", start_date.year),
+        ]
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters += [(date_col, "<=", end_date), ("year", "<=", end_date.year)]
+    partition_names = [
+        d.split("=")[0] for d in os.listdir(root_dir) if "=" in d
+    ]
+    if "year" not in partition_names:
+        filters = [f for f in filters if f[0] != "year"]
+    read_columns = columns
+    if columns is not None and date_col not in columns and filters:
+        read_columns = columns + [date_col]
+    table = pq.read_table(
+        root_dir,
+        columns=read_columns,
+        filters=filters or None,
+        memory_map=memory_map,
+    )
+    df = table.to_pandas()
+    for col in set(partition_names) & set(df.columns):
+        # Partition keys are parsed from directory names, with a type that
+        # depends on the pyarrow version; numeric keys are cast back
+        df[col] = pd.to_numeric(df[col].astype(str), errors="ignore")
+    if columns is not None:
+        df = df[columns]
+    elif "year" in df and "year" in partition_names:
+        df = df.drop(columns="year")
+    return df
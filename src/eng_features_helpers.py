@@ -3,25 +3,80 @@
 
 
 import numpy as np
+import pandas as pd
 
 
 def calc_circ_dt_feat(trig_function, y_frac):
     return trig_function(2 * np.pi * y_frac)
 
 
-def add_datepart(df, fldname, drop=True, inplace=False):
-    "Helper function that adds columns relevant to a date."
-    fld = df[fldname].dt
+def calc_datepart_table(dates):
+    "Helper function that computes the date columns once per unique date."
+    dates = pd.DatetimeIndex(dates)
     doy_fld = "dayofyear"
-    doy = fld.dayofyear
-    woy = fld.isocalendar().week
+    doy = dates.dayofyear.to_numpy()
+    woy = dates.isocalendar().week.to_numpy(dtype=float)
+    cols = {}
     for trcol, trig_func in zip([np.sin, np.cos], ["sin", "cos"]):
-        df[f"{trig_func}_weekday"] = calc_circ_dt_feat(trcol, fld.weekday / 7)
-        df[f"{trig_func}_month"] = calc_circ_dt_feat(trcol, fld.month / 12)
-        df[f"{trig_func}_{doy_fld}"] = calc_circ_dt_feat(trcol, doy / 365)
-        df[f"{trig_func}_quarter"] = calc_circ_dt_feat(trcol, fld.quarter / 4)
-        df[f"{trig_func}_woy"] = calc_circ_dt_feat(trcol, woy / 52)
-        df[f"{trig_func}_woy"] = df[f"{trig_func}_woy"].astype(float)
+        cols[f"{trig_func}_weekday"] = calc_circ_dt_feat(
+            trcol, dates.weekday.to_numpy() / 7
+        )
+        cols[f"{trig_func}_month"] = calc_circ_dt_feat(
+            trcol, dates.month.to_numpy() / 12
+        )
+        cols[f"{trig_func}_{doy_fld}"] = calc_circ_dt_feat(trcol, doy / 365)
+        cols[f"{trig_func}_quarter"] = calc_circ_dt_feat(
+            trcol, dates.quarter.to_numpy() / 4
+        )
+        cols[f"{trig_func}_woy"] = calc_circ_dt_feat(trcol, woy / 52)
+    return pd.DataFrame(cols, index=dates)
+
+
+# Date columns of every day of a range that grows to cover the dates of
+# all add_datepart() calls of the process, e.g. CV folds and predict_future
+_DATEPART_TABLE = None
+
+
+def get_datepart_table(dates):
+    """Return the shared table of date columns, first extended to the range
+    of dates if needed."""
+    global _DATEPART_TABLE
+    table = _DATEPART_TABLE
+    if (
+        table is None
+        or dates.min() < table.index[0]
+        or dates.max() > table.index[-1]
+    ):
+        start, end = dates.min(), dates.max()
+        if table is not None:
+            start, end = min(start, table.index[0]), max(end, table.index[-1])
+        table = calc_datepart_table(pd.date_range(start, end))
+        _DATEPART_TABLE = table
+    return table
+
+
+def add_datepart(df, fldname, drop=True, inplace=False):
+    "Helper function that adds columns relevant to a date."
+    # Date columns are computed once per date and gathered into rows
+    codes, uniques = pd.factorize(df[fldname])
+    uniques = pd.DatetimeIndex(uniques)
+    positions = np.arange(len(uniques))
+    if (
+        len(uniques) == 0
+        or uniques.tz is not None
+        or (uniques != uniques.normalize()).any()
+    ):
+        # Only naive dates without a time of day are in the daily table
+        table = calc_datepart_table(uniques)
+    else:
+        table = get_datepart_table(uniques)
+        positions = table.index.get_indexer(uniques)
+    # Missing dates (code -1) keep missing date columns
+    values = np.full((len(codes), table.shape[1]), np.nan)
+    present = codes >= 0
+    values[present] = table.to_numpy()[positions[codes[present]]]
+    for i, col in enumerate(table.columns):
+        df[col] = values[:, i]
     if drop:
         df.drop(fldname, axis=1, inplace=True)
     if not inplace:
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+import pandas as pd
+
+
+def data_fingerprint(df):
+    """Hash the contents, index, column names and dtypes of a dataframe.
+
+    Args:
+        df (Dataframe): Input data
+
+    Returns:
+        fingerprint (String): Hex digest identifying the data
+    """
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    h.update(str(list(zip(df.columns, df.dtypes.astype(str)))).encode())
+    h.update(str(list(df.index.names)).encode())
+    return h.hexdigest()
+
+
+def config_fingerprint(**params):
+    """Hash feature parameters (lags, window size, dates, etc.).
+
+    Args:
+        params (Dictionary): Parameters used to create the features
+
+    Returns:
+        fingerprint (String): Hex digest identifying the parameters
+    """
+
+    def _default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return str(obj)
+
+    params_str = json.dumps(params, sort_keys=True, default=_default)
+    return hashlib.sha256(params_str.encode()).hexdigest()
+
+
+class FeatureCache:
+    """
+    Content-addressed on-disk cache of feature matrices.
+    Entries are keyed by a fingerprint of the input data and of the feature
+    parameters, and stored as Parquet files. When the total size of the
+    cache exceeds max_size_bytes, the least-recently-used entries are
+    evicted. An exclusive lock file guards writes and evictions, so parallel
+    notebook kernels or papermill runs can share one cache directory.
+    Usage
+    -----
+    > cache = FeatureCache("data/processed/feature_cache")
+    > key = cache.make_key(train_df, lags=lags, window_size=180)
+    > features = cache.get_or_create(key, lambda: build_features(...))
+    """
+
+    def __init__(
+        self,
+        cache_dir=os.path.join("data", "processed", "feature_cache"),
+        max_size_bytes=2 * 1024**3,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock_path = os.path.join(self.cache_dir, ".lock")
+
+    @contextmanager
+    def _lock(self, exclusive):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def make_key(self, data, **feature_params):
+        data_key = data_fingerprint(data)
+        config_key = config_fingerprint(**feature_params)
+        return hashlib.sha256((data_key + config_key).encode()).hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        with self._lock(exclusive=False):
+            if not os.path.exists(path):
+                return None
+            df = pd.read_parquet(path, engine="pyarrow")
+            # Access time drives LRU eviction (atime is unreliable on noatime)
+            os.utime(path)
+        return df
+
+    def put(self, key, df):
+        with self._lock(exclusive=True):
+            with NamedTemporaryFile(
+                dir=self.cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+            try:
+                df.to_parquet(tmp_path, engine="pyarrow")
+                os.replace(tmp_path, self._path(key))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._evict()
+
+    def get_or_create(self, key, create_func):
+        df = self.get(key)
+        if df is None:
+            df = create_func()
+            self.put(key, df)
+        return df
+
+    def _evict(self):
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(".parquet"):
+                st = os.stat(os.path.join(self.cache_dir, fname))
+                entries.append((st.st_mtime, st.st_size, fname))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, fname in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, fname))
+            total_size -= size
+
+    def clear(self):
+        with self._lock(exclusive=True):
+            for fname in os.listdir(self.cache_dir):
+                if fname.endswith(".parquet"):
+                    os.remove(os.path.join(self.cache_dir, fname))
@@ -2,24 +2,82 @@
 # -*- coding: utf-8 -*-
 
 
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 
 
-def df_from_cartesian_product(dict_in):
-    """Generate a Pandas dataframe from Cartesian product of lists.
+def get_series_codes(df, series_cols=["store", "item"]):
+    """Find the series present in df, ordered as in the Cartesian product
+    of the unique values of series_cols (in order of appearance).
 
     Args:
-        dict_in (Dictionary): Dictionary containing multiple lists,
-        e.g. {"fea1": list1, "fea2": list2}
+        df (Dataframe): Long-format time series data
+        series_cols (List): Columns identifying a series, e.g. store and item
 
     Returns:
-        df (Dataframe): Dataframe corresponding to the Caresian product of the
-        lists
+        row_codes (Numpy Array): Position of every row's series in series
+        series (Dataframe): One row per series, with columns series_cols
     """
-    from itertools import product
+    codes = np.zeros(len(df), dtype=np.int64)
+    uniques = []
+    for col in series_cols:
+        col_codes, col_uniques = pd.factorize(df[col])
+        codes = codes * len(col_uniques) + col_codes
+        uniques.append(col_uniques)
+    product_codes, row_codes = np.unique(codes, return_inverse=True)
+    series = {}
+    for col, col_uniques in zip(series_cols[::-1], uniques[::-1]):
+        series[col] = col_uniques[product_codes % len(col_uniques)]
+        product_codes = product_codes // len(col_uniques)
+    series = pd.DataFrame({col: series[col] for col in series_cols})
+    return [row_codes, series]
 
-    cart = list(product(*dict_in.values()))
-    df = pd.DataFrame(cart, columns=dict_in.keys())
+
+def get_series_batches(train_df, series_batch_size):
+    """Split the series of train_df into batches of series_batch_size
+    series, in the order of get_series_codes().
+
+    Args:
+        train_df (Dataframe): Long-format data with store and item columns
+        series_batch_size (Integer): Number of series per batch
+
+    Returns:
+        batch_series (List): Store and item of the series of every batch
+        batch_rows (List): Positions of the rows of every batch
+    """
+    row_codes, series = get_series_codes(train_df, ["store", "item"])
+    order = np.argsort(row_codes, kind="stable")
+    bounds = np.concatenate(
+        [[0], np.cumsum(np.bincount(row_codes, minlength=len(series)))]
+    )
+    first_series = np.arange(0, len(series), series_batch_size)
+    batch_series = [
+        series.iloc[first:last].reset_index(drop=True)
+        for first, last in zip(first_series, first_series + series_batch_size)
+    ]
+    # Row counts up to the first series of every batch
+    batch_rows = np.split(order, bounds[first_series[1:]])
+    return [batch_series, batch_rows]
+
+
+def df_from_series_product(series, dates, date_col="date"):
+    """Generate a Pandas dataframe with every date for every series.
+
+    Args:
+        series (Dataframe): One row per series, e.g. from get_series_codes()
+        dates (Pandas DatetimeIndex): Dates of every series
+        date_col (String): Name of the date column
+
+    Returns:
+        df (Dataframe): Dataframe with len(series) x len(dates) rows, ordered
+        by series and date
+    """
+    grid = {
+        col: np.repeat(series[col].to_numpy(), len(dates)) for col in series
+    }
+    grid[date_col] = np.tile(np.asarray(dates), len(series))
+    df = pd.DataFrame(grid)
     return df
 
 
@@ -86,3 +144,256 @@ def combine_features(df, lag_fea, lags, window_size, used_columns):
     moving_avg = moving_averages(df[lag_fea], min(lags), window_size)
     fea_all = pd.concat([df[used_columns], lagged_fea, moving_avg], axis=1)
     return fea_all
+
+
+def series_date_codes(df, series_cols, date_col):
+    """Map each row to integer (series, date) positions of a dense block.
+
+    Args:
+        df (Dataframe): Long-format time series data
+        series_cols (List): Columns identifying a series, e.g. store and item
+        date_col (String): Name of the date column
+
+    Returns:
+        series_codes (Numpy Array): Series position of every row
+        date_codes (Numpy Array): Position of every row's date in the sorted
+        unique dates
+        n_series (Integer): Number of series
+        n_dates (Integer): Number of unique dates
+    """
+    series_codes = (
+        df.groupby(series_cols, sort=False).ngroup().to_numpy(np.intp)
+    )
+    date_codes, dates = pd.factorize(df[date_col], sort=True)
+    return [series_codes, date_codes, series_codes.max() + 1, len(dates)]
+
+
+def to_dense_block(
+    values, series_codes, date_codes, n_series, n_dates, dtype=float
+):
+    """Scatter long-format values into a dense (series, date) block.
+
+    Args:
+        values (Numpy Array): Values with one entry per row
+        series_codes (Numpy Array): Series position of every row
+        date_codes (Numpy Array): Date position of every row
+        n_series (Integer): Number of series
+        n_dates (Integer): Number of unique dates
+        dtype (Numpy dtype): Floating point type of the block
+
+    Returns:
+        block (Numpy Array): Array of shape (n_series, n_dates)
+    """
+    flat_codes = series_codes * n_dates + date_codes
+    # Positional shifts equal date shifts only on a complete grid
+    assert (np.bincount(flat_codes, minlength=n_series * n_dates) == 1).all()
+    block = np.empty(n_series * n_dates, dtype=dtype)
+    block[flat_codes] = values
+    return block.reshape(n_series, n_dates)
+
+
+def lagged_features_block(block, lags, series_codes, date_codes):
+    """Create lagged features for every row from a dense (series, date) block.
+
+    Args:
+        block (Numpy Array): Array of shape (n_series, n_dates)
+        lags (List): Lag lengths
+        series_codes (Numpy Array): Series position of every row
+        date_codes (Numpy Array): Date position of every row
+
+    Returns:
+        fea (Numpy Array): Array of shape (n_rows, len(lags))
+    """
+    lags = np.asarray(lags)
+    max_lag = lags.max()
+    n_series, n_dates = block.shape
+    padded = np.full((n_series, max_lag + n_dates), np.nan, dtype=block.dtype)
+    padded[:, max_lag:] = block
+    # windows[s, k, t] == padded[s, k + t], i.e. lag (max_lag - k) at date t
+    windows = sliding_window_view(padded, n_dates, axis=1)
+    fea = windows[
+        series_codes[:, None],
+        (max_lag - lags)[None, :],
+        date_codes[:, None],
+    ]
+    return fea
+
+
+def moving_averages_block(
+    block, start_step, series_codes, date_codes, window_size=None
+):
+    """Compute moving averages for every row from a dense (series, date)
+    block, matching moving_averages() applied per series.
+
+    Args:
+        block (Numpy Array): Array of shape (n_series, n_dates)
+        start_step (Integer): Starting time step of rolling mean
+        series_codes (Numpy Array): Series position of every row
+        date_codes (Numpy Array): Date position of every row
+        window_size (Integer): Windows size of rolling mean
+
+    Returns:
+        fea (Numpy Array): Array of shape (n_rows,)
+    """
+    n_series, n_dates = block.shape
+    if window_size is None:
+        # Use a large window to compute average over all historical data
+        window_size = n_dates
+    shifted = np.full((n_series, n_dates), np.nan)
+    shifted[:, start_step:] = block[:, : max(n_dates - start_step, 0)]
+    valid = ~np.isnan(shifted)
+    csum = np.zeros((n_series, n_dates + 1))
+    np.cumsum(np.where(valid, shifted, 0.0), axis=1, out=csum[:, 1:])
+    ccount = np.zeros((n_series, n_dates + 1))
+    np.cumsum(valid, axis=1, out=ccount[:, 1:])
+    ends = date_codes + 1
+    starts = np.maximum(ends - window_size, 0)
+    window_sum = csum[series_codes, ends] - csum[series_codes, starts]
+    window_count = ccount[series_codes, ends] - ccount[series_codes, starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fea = np.where(window_count > 0, window_sum / window_count, np.nan)
+    return fea.astype(block.dtype, copy=False)
+
+
+def combine_features_vectorized(
+    df,
+    lag_fea,
+    lags,
+    window_size,
+    used_columns,
+    series_cols=["store", "item"],
+    date_col="date",
+    dtype=float,
+):
+    """Vectorized equivalent of applying combine_features() to every series.
+
+    The series are turned into one dense (series, date) block, so all lags
+    and the moving average are computed as array operations over all series
+    at once. Requires a complete series x date grid, as built in
+    create_features().
+
+    Args:
+        df (Dataframe): Time series data for all series, including the target
+        series and external features
+        lag_fea (List): A list of column names for creating lagged features
+        lags (Numpy Array): Numpy array including all the lags
+        window_size (Integer): Window size of rolling mean
+        used_columns (List): A list containing the names of columns that are
+        needed in the input dataframe (including the target column)
+        series_cols (List): Columns identifying a series
+        date_col (String): Name of the date column
+        dtype (Numpy dtype): Floating point type of the lag and moving
+        average features, e.g. np.float32 to halve their memory
+
+    Returns:
+        fea_all (Dataframe): Dataframe including all the features, with the
+        same index and columns as the per-series combine_features() output
+    """
+    series_codes, date_codes, n_series, n_dates = series_date_codes(
+        df, series_cols, date_col
+    )
+    lag_arrays, mean_arrays = [], []
+    for col in lag_fea:
+        block = to_dense_block(
+            df[col].to_numpy(dtype),
+            series_codes,
+            date_codes,
+            n_series,
+            n_dates,
+            dtype,
+        )
+        lag_arrays.append(
+            lagged_features_block(block, lags, series_codes, date_codes)
+        )
+        mean_arrays.append(
+            moving_averages_block(
+                block, min(lags), series_codes, date_codes, window_size
+            )
+        )
+    # Same column order as lagged_features(): lag-major, then feature
+    lagged_fea = pd.DataFrame(
+        np.stack(lag_arrays, axis=2).reshape(len(df), -1),
+        index=df.index,
+        columns=[f"{c}_lag{lag}" for lag in lags for c in lag_fea],
+    )
+    moving_avg = pd.DataFrame(
+        np.column_stack(mean_arrays),
+        index=df.index,
+        columns=[f"{c}_mean" for c in lag_fea],
+    )
+    fea_all = pd.concat([df[used_columns], lagged_fea, moving_avg], axis=1)
+    return fea_all
+
+
+def fill_block(block):
+    """Forward-fill, then backward-fill, missing values of every series in a
+    dense (series, date) block.
+
+    Args:
+        block (Numpy Array): Array of shape (n_series, n_dates)
+
+    Returns:
+        filled (Numpy Array): Filled array of shape (n_series, n_dates)
+    """
+    n_series, n_dates = block.shape
+    rows = np.arange(n_series)[:, None]
+    valid = ~np.isnan(block)
+    ffill_idx = np.where(valid, np.arange(n_dates), 0)
+    np.maximum.accumulate(ffill_idx, axis=1, out=ffill_idx)
+    filled = block[rows, ffill_idx]
+    # Leading gaps are still missing after the forward fill
+    valid = ~np.isnan(filled)
+    bfill_idx = np.where(valid, np.arange(n_dates), n_dates - 1)
+    bfill_idx = np.minimum.accumulate(bfill_idx[:, ::-1], axis=1)[:, ::-1]
+    return filled[rows, bfill_idx]
+
+
+def fill_series_gaps(
+    df,
+    fill_cols,
+    series_cols=["store", "item"],
+    date_col="date",
+    count_until=None,
+):
+    """Forward-fill, then backward-fill, missing values within each series of
+    a complete (series, date) grid, without a per-series Python loop.
+
+    Args:
+        df (Dataframe): Long-format grid with one row per series and date
+        fill_cols (List): Numeric columns to fill
+        series_cols (List): Columns identifying a series, e.g. store and item
+        date_col (String): Name of the date column
+        count_until (Timestamp): Last date counted in imputed, e.g. the
+        training end date so future grid dates are not counted; all dates
+        are counted if None
+
+    Returns:
+        df (Dataframe): Copy of df with fill_cols filled
+        imputed (Dataframe): Number of imputed dates per series and column
+    """
+    series_codes, date_codes, n_series, n_dates = series_date_codes(
+        df, series_cols, date_col
+    )
+    df = df.copy()
+    counted = (
+        np.ones(len(df), dtype=bool)
+        if count_until is None
+        else (df[date_col] <= count_until).to_numpy()
+    )
+    n_imputed = {}
+    for col in fill_cols:
+        dtype = np.result_type(df[col].dtype, np.float32)
+        values = df[col].to_numpy(dtype)
+        n_imputed[col] = np.bincount(
+            series_codes,
+            weights=np.isnan(values) & counted,
+            minlength=n_series,
+        ).astype(int)
+        block = to_dense_block(
+            values, series_codes, date_codes, n_series, n_dates, dtype=dtype
+        )
+        df[col] = fill_block(block)[series_codes, date_codes]
+    first_rows = np.unique(series_codes, return_index=True)[1]
+    imputed = df[series_cols].iloc[first_rows].reset_index(drop=True)
+    imputed = imputed.assign(**n_imputed)
+    return [df, imputed]
@@ -2,11 +2,18 @@
 # -*- coding: utf-8 -*-
 
 
+import os
+from tempfile import TemporaryDirectory
+
 import numpy as np
 import pandas as pd
 
 import src.feature_utils as ftu
-from src.utils import create_features_train_predict
+import src.memory_helpers as memh
+import src.ml_helpers as mlh
+import src.shard_helpers as shh
+from src.artifact_helpers import load_artifacts, save_artifacts
+from src.utils import create_features, create_features_train_predict
 
 
 def show_future_prediction_data_dates(data, gap):
@@ -24,24 +31,50 @@ def show_future_prediction_data_dates(data, gap):
     )
 
 
-def get_future_prediction_data_grid(data, gap, horizon):
-    store_list = data["store"].unique()
-    item_list = data["item"].unique()
-    train_end_date = data.index.get_level_values(1).max()
+def get_future_prediction_data_grid(data, gap, horizon, train_end_date=None):
+    if train_end_date is None:
+        train_end_date = data.index.get_level_values(1).max()
     date_list = pd.date_range(
         start=train_end_date + pd.DateOffset(days=gap + 1),
         end=train_end_date + pd.DateOffset(days=gap + horizon),
     )
-    d = {"store": store_list, "item": item_list, "date": date_list}
-    data_grid = ftu.df_from_cartesian_product(d)
-    data_grid = data_grid.assign(
-        symbol=data_grid["store"].astype(str)
-        + "_"
-        + data_grid["item"].astype(str)
-    ).set_index(["symbol", "date"])
+    # Only series present in data are predicted, in the row order of
+    # build_features(); symbols are built once per series, not per row
+    _, series = ftu.get_series_codes(data, ["store", "item"])
+    symbol = series["store"].astype(str) + "_" + series["item"].astype(str)
+    data_grid = ftu.df_from_series_product(series, date_list)
+    data_grid.index = pd.MultiIndex.from_arrays(
+        [np.repeat(symbol.to_numpy(), len(date_list)), data_grid.pop("date")],
+        names=["symbol", "date"],
+    )
     return data_grid
 
 
+def get_feature_config(
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    compact,
+    preprocessing,
+):
+    "Helper function that collects the feature config saved with a model."
+    return {
+        "lags": list(lags),
+        "window_size": window_size,
+        "used_columns": used_columns,
+        "categ_fea": categ_fea,
+        "first_date": first_date,
+        "gap": gap,
+        "horizon": horizon,
+        "compact": compact,
+        "preprocessing": preprocessing,
+    }
+
+
 def predict_future(
     r,
     data_train,
@@ -56,36 +89,200 @@ def predict_future(
     model_params,
     scoring_func,
     model_fit_params={"early_stoppin_rounds": 200, "verbose": 0},
+    feature_cache=None,
+    compact=False,
+    memory_report=None,
+    preprocessing="ohe_scale",
+    dataset_manager=None,
+    artifact_dir=None,
+    report_path=None,
+    shard_dir=None,
+    series_batch_size=500,
+    feature_n_jobs=1,
 ):
+    """Train on all of data_train and forecast the horizon after the gap.
+
+    If shard_dir is given, features are built series_batch_size series at a
+    time into Parquet shards and streamed into training and prediction (see
+    shard_helpers), which needs preprocessing="tree_native". The shards go
+    to a subdirectory of shard_dir that is removed before returning.
+    Otherwise feature_n_jobs != 1 builds features with
+    build_features_parallel().
+    """
+    if report_path is not None and memory_report is None:
+        memory_report = []
     show_future_prediction_data_dates(data_train, gap)
 
-    (
-        _,
-        y_pred_test,
+    if shard_dir is None:
+        (
+            X_test,
+            y_pred_test,
+            trained_model,
+            train_end_date,
+            test_start_date_manual,
+            test_end_date_manual,
+            fitted_preprocessor,
+            test_keys,
+        ) = create_features_train_predict(
+            data_train,
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            r,
+            first_date,
+            gap,
+            horizon,
+            data_test,
+            model_params,
+            model_fit_params,
+            scoring_func,
+            feature_cache,
+            compact=compact,
+            memory_report=memory_report,
+            preprocessing=preprocessing,
+            dataset_manager=dataset_manager,
+            feature_n_jobs=feature_n_jobs,
+            return_fold_info=True,
+        )
+        feature_cols = list(X_test)
+        df_future_pred = get_future_prediction_data_grid(
+            data_train, gap, horizon
+        )
+        # Feature rows are in date order, the grid in series order
+        y_pred_test = mlh.align_to_keys(
+            y_pred_test, test_keys, df_future_pred.reset_index()
+        )
+    else:
+        if preprocessing != "tree_native":
+            raise ValueError(
+                "Feature shards (shard_dir) need preprocessing='tree_native', "
+                f"got {preprocessing!r}"
+            )
+        os.makedirs(shard_dir, exist_ok=True)
+        # Each call writes to, and removes, its own subdirectory
+        with TemporaryDirectory(prefix="predict-", dir=shard_dir) as call_dir:
+            shard_paths, train_end_date = shh.write_feature_shards(
+                data_train,
+                lags,
+                window_size,
+                used_columns,
+                first_date,
+                gap,
+                horizon,
+                call_dir,
+                series_batch_size,
+                compact,
+                memory_report,
+            )
+            (
+                y_pred_test,
+                trained_model,
+                fitted_preprocessor,
+                feature_cols,
+                test_keys,
+            ) = shh.train_predict_from_shards(
+                shard_paths,
+                train_end_date,
+                gap,
+                categ_fea,
+                model_params,
+                model_fit_params,
+                scoring_func,
+                compact,
+                memory_report=memory_report,
+            )
+        test_start_date_manual = test_keys["date"].min().strftime("%Y-%m-%d")
+        test_end_date_manual = test_keys["date"].max().strftime("%Y-%m-%d")
+        df_future_pred = get_future_prediction_data_grid(
+            data_train, gap, horizon, train_end_date
+        )
+        # Shard rows are in date order, the grid in series order
+        y_pred_test = mlh.align_to_keys(
+            y_pred_test, test_keys, df_future_pred.reset_index()
+        )
+    if artifact_dir is not None:
+        feature_config = get_feature_config(
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            first_date,
+            gap,
+            horizon,
+            compact,
+            preprocessing,
+        )
+        save_artifacts(
+            artifact_dir,
+            trained_model,
+            fitted_preprocessor,
+            feature_cols,
+            feature_config,
+            train_end_date,
+        )
+    df_future_pred["pred"] = np.expm1(y_pred_test)
+    if report_path is not None:
+        memh.write_stage_report(memory_report, report_path)
+    return [
+        df_future_pred,
         trained_model,
         train_end_date,
         test_start_date_manual,
         test_end_date_manual,
-    ) = create_features_train_predict(
+    ]
+
+
+def predict_future_from_artifacts(
+    data_train, artifact_dir, feature_cache=None, train_end_date=None
+):
+    """Forecast with a model and preprocessors saved by
+    predict_future(..., artifact_dir=...), without retraining.
+
+    Features are built from data_train with the saved feature config, so
+    the forecast starts gap + 1 days after the last date in data_train,
+    or after train_end_date if given.
+    """
+    bundle = load_artifacts(artifact_dir)
+    cfg = bundle["feature_config"]
+    show_future_prediction_data_dates(data_train, cfg["gap"])
+
+    features, train_end_date = create_features(
         data_train,
-        lags,
-        window_size,
-        used_columns,
-        categ_fea,
-        r,
-        first_date,
-        gap,
-        horizon,
-        data_test,
-        model_params,
-        model_fit_params,
-        scoring_func,
+        cfg["lags"],
+        cfg["window_size"],
+        cfg["used_columns"],
+        0,
+        cfg["first_date"],
+        cfg["gap"],
+        cfg["horizon"],
+        pd.DataFrame(),
+        feature_cache,
+        cfg["compact"],
+        train_end_date=train_end_date,
+    )
+    test_start_date = train_end_date + pd.DateOffset(days=cfg["gap"] + 1)
+    test_fea = features[features["date"] >= test_start_date].reset_index(
+        drop=True
+    )
+    test_start_date_manual = test_fea["date"].min().strftime("%Y-%m-%d")
+    test_end_date_manual = test_fea["date"].max().strftime("%Y-%m-%d")
+
+    X_test = test_fea.drop(["sales", "date"], axis=1)
+    X_test = mlh.apply_preprocessor(bundle["fitted_preprocessor"], X_test)
+    assert list(X_test) == bundle["feature_cols"]
+    y_pred_test = bundle["model"].predict(X_test)
+
+    df_future_pred = get_future_prediction_data_grid(
+        data_train, cfg["gap"], cfg["horizon"], train_end_date
+    )
+    # Feature rows are in date order, the grid in series order
+    df_future_pred["pred"] = np.expm1(
+        mlh.align_to_keys(y_pred_test, test_fea, df_future_pred.reset_index())
     )
-    df_future_pred = get_future_prediction_data_grid(data_train, gap, horizon)
-    df_future_pred["pred"] = np.expm1(y_pred_test)
     return [
         df_future_pred,
-        trained_model,
+        bundle["model"],
         train_end_date,
         test_start_date_manual,
         test_end_date_manual,
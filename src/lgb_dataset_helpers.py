@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+
+import lightgbm as lgb
+
+from src.feature_cache import config_fingerprint, data_fingerprint
+
+# LightGBM parameters that change how a Dataset is binned, see
+# https://lightgbm.readthedocs.io/en/latest/Parameters.html#dataset-parameters
+# seed sets data_random_seed when that is not given
+BINNING_PARAMS = [
+    "max_bin",
+    "max_bin_by_feature",
+    "min_data_in_bin",
+    "bin_construct_sample_cnt",
+    "data_random_seed",
+    "seed",
+    "feature_pre_filter",
+    "min_data_in_leaf",
+    "use_missing",
+    "zero_as_missing",
+    "enable_bundle",
+    "is_enable_sparse",
+    "linear_tree",
+    "categorical_feature",
+    "max_cat_to_onehot",
+    "max_cat_threshold",
+]
+
+# Aliases of BINNING_PARAMS, mapped to their main name
+BINNING_PARAM_ALIASES = {
+    "max_bins": "max_bin",
+    "subsample_for_bin": "bin_construct_sample_cnt",
+    "data_seed": "data_random_seed",
+    "random_seed": "seed",
+    "random_state": "seed",
+    "min_data_per_leaf": "min_data_in_leaf",
+    "min_data": "min_data_in_leaf",
+    "min_child_samples": "min_data_in_leaf",
+    "min_samples_leaf": "min_data_in_leaf",
+    "is_enable_bundle": "enable_bundle",
+    "bundle": "enable_bundle",
+    "is_sparse": "is_enable_sparse",
+    "enable_sparse": "is_enable_sparse",
+    "sparse": "is_enable_sparse",
+    "linear_trees": "linear_tree",
+    "cat_feature": "categorical_feature",
+    "categorical_column": "categorical_feature",
+    "cat_column": "categorical_feature",
+    "categorical_features": "categorical_feature",
+}
+
+
+def get_binning_params(model_params):
+    """Return the binning parameters of model_params under their main
+    names; as in LightGBM, a main name takes precedence over its
+    aliases."""
+    binning_params = {}
+    for name, value in model_params.items():
+        main_name = BINNING_PARAM_ALIASES.get(name, name)
+        if main_name not in BINNING_PARAMS:
+            continue
+        if name == main_name or main_name not in model_params:
+            binning_params[main_name] = value
+    return binning_params
+
+
+class LGBDatasetManager:
+    """
+    Build each binned lgb.Dataset once and reuse it.
+    A training Dataset is keyed by a fingerprint of the training data, the
+    feature names, the categorical features and the binning parameters in
+    model_params. Hyperparameter candidates that only change non-binning
+    parameters (num_leaves, learning_rate, ...) reuse the same Dataset, kept
+    in memory and, if cache_dir is given, saved in LightGBM's binary format
+    for other processes and later runs.
+    In-memory reuse is per process: a manager pickled to a worker process
+    starts without Datasets, so across processes (score_model(n_jobs > 1),
+    later runs) Datasets are only reused through cache_dir.
+    successive_halving_search() keeps one manager per worker process for
+    all of its candidates. Training data is fingerprinted once per
+    X_train/y_train object, so do not modify them in place between calls.
+    A manager is meant to serve one CV run or search, whose folds it keeps
+    binned: at most max_datasets Datasets are kept in memory (all if None)
+    and the least recently used one is dropped first. Datasets free their
+    copy of the raw training data once constructed.
+    Usage
+    -----
+    > dm = LGBDatasetManager("data/processed/lgb_datasets")
+    > y_pred, model = model_train_predict(..., dataset_manager=dm)
+    """
+
+    def __init__(self, cache_dir=None, max_datasets=8):
+        self.cache_dir = cache_dir
+        self.max_datasets = max_datasets
+        self._datasets = OrderedDict()
+        self._data_keys = {}
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Constructed Datasets hold C handles and can not be pickled
+        state = self.__dict__.copy()
+        state["_datasets"] = OrderedDict()
+        state["_data_keys"] = {}
+        return state
+
+    def get_data_key(self, X_train, y_train):
+        "Helper method that fingerprints each training set only once."
+        ids = (id(X_train), id(y_train))
+        entry = self._data_keys.get(ids)
+        # Ids of garbage-collected objects can be reused by new ones
+        if (
+            entry is not None
+            and entry[0]() is X_train
+            and entry[1]() is y_train
+        ):
+            return entry[2]
+        data_key = data_fingerprint(X_train.assign(__label__=y_train.values))
+        # Forget the fingerprints of garbage-collected training sets
+        for old_ids, old_entry in list(self._data_keys.items()):
+            if old_entry[0]() is None or old_entry[1]() is None:
+                del self._data_keys[old_ids]
+        self._data_keys[ids] = (
+            weakref.ref(X_train),
+            weakref.ref(y_train),
+            data_key,
+        )
+        return data_key
+
+    def make_key(
+        self,
+        X_train,
+        y_train,
+        feature_cols,
+        model_params,
+        categorical_feature="auto",
+    ):
+        data_key = self.get_data_key(X_train, y_train)
+        config_key = config_fingerprint(
+            feature_cols=feature_cols,
+            categorical_feature=categorical_feature,
+            binning_params=get_binning_params(model_params),
+        )
+        return hashlib.sha256((data_key + config_key).encode()).hexdigest()
+
+    def get_train_dataset(
+        self,
+        X_train,
+        y_train,
+        feature_cols,
+        model_params,
+        categorical_feature="auto",
+        key=None,
+    ):
+        if key is None:
+            key = self.make_key(
+                X_train,
+                y_train,
+                feature_cols,
+                model_params,
+                categorical_feature,
+            )
+        if key in self._datasets:
+            self._datasets.move_to_end(key)
+            return self._datasets[key]
+
+        binning_params = get_binning_params(model_params)
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, f"{key}.bin")
+        if path is not None and os.path.exists(path):
+            lgbtrain = lgb.Dataset(path, params=binning_params)
+        else:
+            lgbtrain = lgb.Dataset(
+                data=X_train,
+                label=y_train,
+                feature_name=feature_cols,
+                categorical_feature=categorical_feature,
+                params=binning_params,
+            )
+            if path is not None:
+                lgbtrain.construct()
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                lgbtrain.save_binary(tmp_path)
+                os.replace(tmp_path, path)
+        self._datasets[key] = lgbtrain
+        if (
+            self.max_datasets is not None
+            and len(self._datasets) > self.max_datasets
+        ):
+            self._datasets.popitem(last=False)
+        return lgbtrain
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+def frame_memory_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def downcast_ints(df, cols):
+    """Downcast integer key columns (e.g. store, item) to the smallest
+    integer type that holds them."""
+    for col in cols:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+def compact_raw_data(df, key_cols=["store", "item"], target_col="sales"):
+    """Return raw sales with small integer keys and float32 sales."""
+    df = downcast_ints(df.copy(), key_cols)
+    df[target_col] = df[target_col].astype(np.float32)
+    return df
+
+
+# Open stages, so that nested stages do not lose their parents' peaks
+_STAGE_STACK = []
+
+
+@contextmanager
+def track_stage(stage, memory_report=None, rows_in=None):
+    """Record wall time, CPU time, peak memory and row counts of a stage.
+
+    Does nothing unless memory_report is a list, to which a
+    {"stage", "wall_s", "cpu_s", "peak_mb", "retained_mb", "rows_in",
+    "rows_out"} record is appended. Peaks are measured with tracemalloc,
+    which NumPy and pandas buffers report to; stages may be nested. Python
+    < 3.9 can not reset the traced peak, so there only the outermost stage
+    gets a peak and the others record NaN. The record is yielded so that
+    the stage can set "rows_out".
+    """
+    if memory_report is None:
+        yield {}
+        return
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif _STAGE_STACK:
+        _STAGE_STACK[-1]["peak"] = max(
+            _STAGE_STACK[-1]["peak"], tracemalloc.get_traced_memory()[1]
+        )
+    # Without reset_peak() the traced peak is that of the whole tracing
+    # session, i.e. of the stage that started it
+    peak_known = started_tracing or hasattr(tracemalloc, "reset_peak")
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    state = {"peak": start}
+    _STAGE_STACK.append(state)
+    record = {"stage": stage, "rows_in": rows_in, "rows_out": None}
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        wall_s = time.perf_counter() - start_wall
+        cpu_s = time.process_time() - start_cpu
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, state["peak"])
+        _STAGE_STACK.pop()
+        if _STAGE_STACK:
+            _STAGE_STACK[-1]["peak"] = max(_STAGE_STACK[-1]["peak"], peak)
+        if started_tracing:
+            tracemalloc.stop()
+        record.update(
+            wall_s=wall_s,
+            cpu_s=cpu_s,
+            peak_mb=(peak - start) / 2**20 if peak_known else np.nan,
+            retained_mb=(current - start) / 2**20,
+        )
+        memory_report.append(record)
+        print(
+            f"{stage}: {wall_s:.2f}s wall, {cpu_s:.2f}s CPU, "
+            f"peak memory {record['peak_mb']:.1f} MB, "
+            f"retained {record['retained_mb']:.1f} MB"
+        )
+
+
+def write_stage_report(memory_report, path):
+    """Write stage records as JSON lines, one record per line."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for record in memory_report:
+            f.write(json.dumps(record, default=str) + "\n")
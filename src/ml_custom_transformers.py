@@ -5,7 +5,7 @@
 import numpy as np
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
 
 
 class DFOneHotEncoder(BaseEstimator, TransformerMixin):
@@ -28,11 +28,12 @@ class DFOneHotEncoder(BaseEstimator, TransformerMixin):
     )
     """
 
-    def __init__(self):
+    def __init__(self, dtype=np.float64):
         self.ohe = None
+        self.dtype = dtype
 
     def fit(self, X, y=None):
-        self.ohe = OneHotEncoder(handle_unknown="ignore")
+        self.ohe = OneHotEncoder(handle_unknown="ignore", dtype=self.dtype)
         self.ohe.fit(X)
         cdt = dict(zip([f"x{c}" for c in range(X.shape[1])], list(X)))
         self._feature_names = [
@@ -55,6 +56,35 @@ class DFOneHotEncoder(BaseEstimator, TransformerMixin):
         return Xiohe
 
 
+class DFOrdinalEncoder(BaseEstimator, TransformerMixin):
+    """Integer-code categoricals for tree models' native categorical
+    support. Categories unseen during fit are coded as -1, which LightGBM
+    treats as missing."""
+
+    def __init__(self, dtype=np.int32):
+        self.oe = None
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        self.oe = OrdinalEncoder(
+            handle_unknown="use_encoded_value", unknown_value=-1
+        )
+        self.oe.fit(X)
+        return self
+
+    def transform(self, X):
+        Xoe = pd.DataFrame(
+            self.oe.transform(X).astype(self.dtype),
+            index=X.index,
+            columns=X.columns,
+        )
+        return Xoe
+
+    def inverse_transform(self, X):
+        Xioe = self.oe.inverse_transform(X)
+        return Xioe
+
+
 class DFLog1p(TransformerMixin):
     def __init__(self, col_name):
         self.col_name = col_name
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 
+import numpy as np
 import pandas as pd
 from scipy import stats
 from sklearn.compose import ColumnTransformer
@@ -16,17 +17,51 @@ def check_normality(y):
     return p < alpha
 
 
+def take_rows(features, rows):
+    """Helper function that returns rows (a slice or a boolean mask) of
+    features with a fresh RangeIndex; slices stay views."""
+    if isinstance(rows, slice):
+        taken = features.iloc[rows]
+    else:
+        taken = features[rows]
+    # Assigning the index does not copy the data, unlike reset_index()
+    taken.index = pd.RangeIndex(len(taken))
+    return taken
+
+
 def train_test_gap_split(train_end_date, gap, features):
-    train_mask = features["date"] <= train_end_date
-    train_fea = features[train_mask].reset_index(drop=True)
-    train_end_date_manual = max(train_fea["date"]).strftime("%Y-%m-%d")
+    """Split features into training rows up to train_end_date and test rows
+    from train_end_date + gap + 1 on, keeping the row order on each side.
+
+    Features from build_features() are sorted by date, so both sides are
+    slices found by binary search. Other frames are split with boolean
+    masks, which is cheaper than sorting them.
+    """
+    dates = features["date"].to_numpy()
+    train_end_date64 = np.datetime64(train_end_date)
+    test_start_date64 = np.datetime64(
+        train_end_date + pd.DateOffset(days=gap + 1)
+    )
+    if features["date"].is_monotonic_increasing:
+        train_end = np.searchsorted(dates, train_end_date64, "right")
+        test_start = np.searchsorted(dates, test_start_date64, "left")
+        train_rows = slice(0, train_end)
+        test_rows = slice(test_start, len(dates))
+        train_dates, test_dates = dates[train_rows], dates[test_rows]
+    else:
+        train_rows = dates <= train_end_date64
+        test_rows = dates >= test_start_date64
+        train_dates, test_dates = dates[train_rows], dates[test_rows]
+    train_fea = take_rows(features, train_rows)
+    test_fea = take_rows(features, test_rows)
+    train_end_date_manual = pd.Timestamp(train_dates.max()).strftime(
+        "%Y-%m-%d"
+    )
     assert train_end_date_manual == train_end_date.strftime("%Y-%m-%d")
-    test_dates_mask = features["date"] >= train_end_date + pd.DateOffset(
-        days=gap + 1
+    test_start_date_manual = pd.Timestamp(test_dates.min()).strftime(
+        "%Y-%m-%d"
     )
-    test_fea = features[test_dates_mask].reset_index(drop=True)
-    test_start_date_manual = min(test_fea["date"]).strftime("%Y-%m-%d")
-    test_end_date_manual = max(test_fea["date"]).strftime("%Y-%m-%d")
+    test_end_date_manual = pd.Timestamp(test_dates.max()).strftime("%Y-%m-%d")
     print(
         "Max. training date = {}, Test/Prediction Dates = {} - {}".format(
             train_end_date_manual,
@@ -43,6 +78,16 @@ def train_test_gap_split(train_end_date, gap, features):
     ]
 
 
+def align_to_keys(values, keys, target, key_cols=["store", "item", "date"]):
+    """Reorder values, one per row of keys, to the rows of target, matching
+    rows on key_cols instead of relying on both being in the same order."""
+    positions = pd.MultiIndex.from_frame(keys[key_cols]).get_indexer(
+        pd.MultiIndex.from_frame(target[key_cols])
+    )
+    assert (positions >= 0).all(), "values do not cover every row of target"
+    return np.asarray(values)[positions]
+
+
 def get_xy(train_fea, test_fea, y_name):
     X_train = train_fea.drop([y_name, "date"], axis=1)
     y_train = train_fea[y_name]
@@ -51,26 +96,31 @@ def get_xy(train_fea, test_fea, y_name):
     return [X_train, y_train, X_val]
 
 
-def preprocess_features(X_train, X_test, categ_fea):
+def preprocess_features(
+    X_train, X_test, categ_fea, compact=False, return_preprocessor=False
+):
+    """One-hot encode categoricals and scale numericals.
+
+    With return_preprocessor=True the fitted preprocessor, as used by
+    apply_preprocessor(), is returned as an extra last item.
+    """
     # One-Hot Encode categoricals
-    categorical_transformer = mlct.DFOneHotEncoder()
+    categorical_transformer = mlct.DFOneHotEncoder(
+        np.float32 if compact else np.float64
+    )
     preprocessor = ColumnTransformer(
         transformers=[("cat", categorical_transformer, categ_fea)],
         remainder="passthrough",
     )
-    pipe_preprocess = Pipeline(steps=[("pp", preprocessor)])
-    pipe_preprocess = pipe_preprocess.fit(X_train)
+    pipe_ohe = Pipeline(steps=[("pp", preprocessor)])
+    pipe_ohe = pipe_ohe.fit(X_train)
     ohe_cols_names = [
         x.replace("cat__", "")
-        for x in pipe_preprocess.named_steps["pp"].get_feature_names()
+        for x in pipe_ohe.named_steps["pp"].get_feature_names()
     ]
     # print(ohe_cols_names)
     X_train = pd.DataFrame(
-        pipe_preprocess.transform(X_train),
-        columns=ohe_cols_names,
-    )
-    X_test = pd.DataFrame(
-        pipe_preprocess.transform(X_test),
+        pipe_ohe.transform(X_train),
         columns=ohe_cols_names,
     )
     # print(list(X_train))
@@ -87,28 +137,96 @@ def preprocess_features(X_train, X_test, categ_fea):
         transformers=[("nums", numerical_transformer, non_cats_enc)],
         remainder="passthrough",
     )
-    pipe_preprocess = Pipeline(steps=[("pp", preprocessor)])
-    pipe_preprocess = pipe_preprocess.fit(X_train)
-    X_train = pd.DataFrame(
-        pipe_preprocess.transform(X_train),
-        columns=non_cats_enc + cats_enc,
-    )
-    X_test = pd.DataFrame(
-        pipe_preprocess.transform(X_test),
+    pipe_scale = Pipeline(steps=[("pp", preprocessor)])
+    pipe_scale = pipe_scale.fit(X_train)
+
+    fitted_preprocessor = {
+        "preprocessing": "ohe_scale",
+        "compact": compact,
+        "pipe_ohe": pipe_ohe,
+        "ohe_cols_names": ohe_cols_names,
+        "pipe_scale": pipe_scale,
+        "cats_enc": cats_enc,
+        "non_cats_enc": non_cats_enc,
+    }
+    X_train = scale_ohe_features(fitted_preprocessor, X_train)
+    X_test = apply_preprocessor(fitted_preprocessor, X_test)
+    # display(X_train.dtypes.to_frame())
+    if return_preprocessor:
+        return [X_train, X_test, cats_enc, non_cats_enc, fitted_preprocessor]
+    return [X_train, X_test, cats_enc, non_cats_enc]
+
+
+def scale_ohe_features(fitted_preprocessor, X_ohe):
+    cats_enc = fitted_preprocessor["cats_enc"]
+    non_cats_enc = fitted_preprocessor["non_cats_enc"]
+    X = pd.DataFrame(
+        fitted_preprocessor["pipe_scale"].transform(X_ohe),
         columns=non_cats_enc + cats_enc,
     )
-    # print(list(X_train))
-    # display(X_train.head())
+    # print(list(X))
+    # display(X.head())
 
     # Change datatypes after processing
-    X_train[cats_enc] = X_train[cats_enc].astype(int)
-    X_train[non_cats_enc] = X_train[non_cats_enc].astype(float)
-    X_test[cats_enc] = X_test[cats_enc].astype(int)
-    X_test[non_cats_enc] = X_test[non_cats_enc].astype(float)
-    # display(X_train.dtypes.to_frame())
+    cats_dtype, non_cats_dtype = (
+        (np.uint8, np.float32)
+        if fitted_preprocessor["compact"]
+        else (int, float)
+    )
+    X[cats_enc] = X[cats_enc].astype(cats_dtype)
+    X[non_cats_enc] = X[non_cats_enc].astype(non_cats_dtype)
+    return X
+
+
+def preprocess_features_tree_native(
+    X_train, X_test, categ_fea, compact=False, return_preprocessor=False
+):
+    """Integer-code categoricals, to be passed to LightGBM as categorical
+    features; numericals are left unscaled since trees do not need it.
+
+    Returns the same items as preprocess_features().
+    """
+    categorical_transformer = mlct.DFOrdinalEncoder()
+    categorical_transformer = categorical_transformer.fit(X_train[categ_fea])
+    cats_enc = list(categ_fea)
+    non_cats_enc = [c for c in list(X_train) if c not in cats_enc]
+    fitted_preprocessor = {
+        "preprocessing": "tree_native",
+        "compact": compact,
+        "ordinal_encoder": categorical_transformer,
+        "cats_enc": cats_enc,
+        "non_cats_enc": non_cats_enc,
+    }
+    X_train = apply_preprocessor(fitted_preprocessor, X_train)
+    X_test = apply_preprocessor(fitted_preprocessor, X_test)
+    if return_preprocessor:
+        return [X_train, X_test, cats_enc, non_cats_enc, fitted_preprocessor]
     return [X_train, X_test, cats_enc, non_cats_enc]
 
 
+def apply_preprocessor(fitted_preprocessor, X):
+    """Transform features with preprocessors fitted by preprocess_features()
+    or preprocess_features_tree_native()."""
+    if fitted_preprocessor["preprocessing"] == "ohe_scale":
+        X_ohe = pd.DataFrame(
+            fitted_preprocessor["pipe_ohe"].transform(X),
+            columns=fitted_preprocessor["ohe_cols_names"],
+        )
+        return scale_ohe_features(fitted_preprocessor, X_ohe)
+
+    cats_enc = fitted_preprocessor["cats_enc"]
+    non_cats_enc = fitted_preprocessor["non_cats_enc"]
+    non_cats_dtype = np.float32 if fitted_preprocessor["compact"] else float
+    X = pd.concat(
+        [
+            fitted_preprocessor["ordinal_encoder"].transform(X[cats_enc]),
+            X[non_cats_enc].astype(non_cats_dtype),
+        ],
+        axis=1,
+    ).reset_index(drop=True)
+    return X
+
+
 def transform_target(y):
     log1p_pipe = Pipeline([("log1p", mlct.DFLog1p("sales"))])
     y = log1p_pipe.fit_transform(y.to_frame()).squeeze()
@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 
+import weakref
+from time import time
+
 import numpy as np
+import pandas as pd
 
 
 def smape(preds, target):
@@ -26,3 +30,231 @@ def lgbm_smape_sklearn(y, yhat):
     # need np.expm1(...) since target was log-scaled in step 11.
     smape_val = smape(np.expm1(yhat), np.expm1(y))
     return "SMAPE", smape_val, False
+
+
+def smape_breakdown(
+    y_pred, y_true, folds=None, series_level="symbol", date_level="date"
+):
+    """SMAPE per series, per fold, per horizon day and overall, in one pass.
+
+    y_pred and y_true are Series indexed by (series, date); predictions are
+    aligned to y_true by index, not by row order. Each row's SMAPE term is
+    computed once and reduced per group with np.bincount over integer group
+    codes. As in smape(), rows where both values are zero count as zero
+    error.
+
+    Args:
+        y_pred (Series): Predictions
+        y_true (Series): True values
+        folds (Array): Optional CV fold of each row of y_true; horizon days
+        are counted from the first date of each fold
+
+    Returns:
+        breakdown (Dictionary): "overall" (Float), and "by_series", "by_fold",
+        "by_horizon_day" (Series)
+    """
+    preds = y_pred.reindex(y_true.index).to_numpy(dtype=float)
+    assert not np.isnan(preds).any(), "y_pred does not cover y_true"
+    target = y_true.to_numpy(dtype=float)
+    num = np.abs(preds - target)
+    denom = np.abs(preds) + np.abs(target)
+    terms = np.zeros_like(num)
+    np.divide(200 * num, denom, out=terms, where=denom != 0)
+
+    def _grouped(codes, uniques, name):
+        sums = np.bincount(codes, weights=terms, minlength=len(uniques))
+        counts = np.bincount(codes, minlength=len(uniques))
+        return pd.Series(sums / counts, index=uniques, name=name)
+
+    series_codes, series_uniques = pd.factorize(
+        y_true.index.get_level_values(series_level), sort=True
+    )
+    if folds is None:
+        folds = np.ones(len(y_true), dtype=int)
+    fold_codes, fold_uniques = pd.factorize(np.asarray(folds), sort=True)
+    dates = y_true.index.get_level_values(date_level).to_numpy("M8[D]")
+    day_nums = dates.astype(np.int64)
+    fold_start = np.full(len(fold_uniques), day_nums.max())
+    np.minimum.at(fold_start, fold_codes, day_nums)
+    horizon_days = day_nums - fold_start[fold_codes] + 1
+    horizon_codes = horizon_days - 1
+
+    by_series = _grouped(series_codes, series_uniques, "smape")
+    by_series.index.name = series_level
+    by_fold = _grouped(fold_codes, fold_uniques, "smape")
+    by_fold.index.name = "fold"
+    by_horizon_day = _grouped(
+        horizon_codes, np.arange(1, horizon_codes.max() + 2), "smape"
+    )
+    by_horizon_day.index.name = "horizon_day"
+    return {
+        "overall": terms.sum() / len(terms),
+        "by_series": by_series,
+        "by_fold": by_fold,
+        "by_horizon_day": by_horizon_day,
+    }
+
+
+def smape_breakdown_from_records(scoring_records, data):
+    """Run smape_breakdown() on the fold records of
+    score_model(..., return_predictions=True)."""
+    y_pred = pd.concat([rec["y_pred"] for rec in scoring_records])
+    folds = np.concatenate(
+        [np.full(len(rec["y_pred"]), rec["fold"]) for rec in scoring_records]
+    )
+    y_true = data["sales"].reindex(y_pred.index)
+    return smape_breakdown(y_pred, y_true, folds)
+
+
+class LGBMSmape:
+    """
+    Drop-in replacement for lgbm_smape as LightGBM's feval, with less
+    per-round overhead.
+    The expm1 of each Dataset's labels is computed once and cached, and the
+    SMAPE is computed in preallocated buffers. With eval_every=N the metric
+    is only recomputed every N rounds per Dataset and the last value is
+    reported in between, so keep N well below early_stopping_rounds. Time
+    spent in the metric is accumulated in time_spent.
+    Cached state must not carry over between training runs, e.g. of
+    candidates sharing a Dataset: train_lgbm() calls reset() before every
+    run; call it yourself when passing the metric to lgb.train() directly.
+    Datasets are only weakly referenced.
+    Usage
+    -----
+    > feval = LGBMSmape(eval_every=10)
+    > telemetry = LGBMTelemetry(feval)
+    > lgb_fit_params["callbacks"] = telemetry.callbacks()
+    > score_model(..., feval, lgb_fit_params)
+    """
+
+    def __init__(self, eval_every=1):
+        self.eval_every = eval_every
+        self.time_spent = 0.0
+        self._cache = {}
+
+    def __getstate__(self):
+        # Cached Datasets can not be pickled to worker processes
+        state = self.__dict__.copy()
+        state["_cache"] = {}
+        return state
+
+    def reset(self):
+        "Forget the cached labels and last values of every Dataset."
+        self._cache = {}
+
+    def _drop(self, key, dataset_ref):
+        "Helper method that drops the entry of a garbage-collected Dataset."
+        entry = self._cache.get(key)
+        if entry is not None and entry["dataset"] is dataset_ref:
+            del self._cache[key]
+
+    def _get_cache(self, dataset):
+        key = id(dataset)
+        entry = self._cache.get(key)
+        if entry is None or entry["dataset"]() is not dataset:
+            target = np.expm1(dataset.get_label().astype(float))
+            entry = {
+                "dataset": weakref.ref(
+                    dataset, lambda ref: self._drop(key, ref)
+                ),
+                "target": target,
+                "abs_target": np.abs(target),
+                "preds": np.empty_like(target),
+                "num": np.empty_like(target),
+                "denom": np.empty_like(target),
+                "calls": 0,
+                "value": np.nan,
+            }
+            self._cache[key] = entry
+        return entry
+
+    def __call__(self, preds, train_data):
+        start_time = time()
+        c = self._get_cache(train_data)
+        if c["calls"] % self.eval_every == 0:
+            # need np.expm1(...) since target was log-scaled in step 11.
+            np.expm1(preds, out=c["preds"])
+            np.subtract(c["preds"], c["target"], out=c["num"])
+            np.abs(c["num"], out=c["num"])
+            np.abs(c["preds"], out=c["denom"])
+            np.add(c["denom"], c["abs_target"], out=c["denom"])
+            # Rows where both are zero keep num == 0, as masked in smape()
+            np.divide(
+                c["num"], c["denom"], out=c["num"], where=c["denom"] != 0
+            )
+            c["value"] = 200 * c["num"].sum() / len(c["num"])
+        c["calls"] += 1
+        self.time_spent += time() - start_time
+        return "SMAPE", c["value"], False
+
+
+class LGBMTelemetryHook:
+    def __init__(self, telemetry, before_iteration):
+        self.telemetry = telemetry
+        self.before_iteration = before_iteration
+        # Runs before early_stopping (order 30), which may raise to stop
+        self.order = 0 if before_iteration else 25
+
+    def __call__(self, env):
+        if self.before_iteration:
+            self.telemetry.start_iteration(env)
+        else:
+            self.telemetry.end_iteration(env)
+
+
+class LGBMTelemetry:
+    """
+    Records the wall time of every boosting round (training and
+    evaluation) and the part of it spent in a LGBMSmape metric.
+    Pass telemetry.callbacks() to lgb.train(callbacks=...), e.g. through
+    model_fit_params["callbacks"].
+    records only holds the last run of this process. score_model() and
+    successive_halving_search() add a copy of every run's records to its
+    fold record, under "telemetry", which also works with worker processes
+    (n_jobs > 1).
+    """
+
+    def __init__(self, metric=None):
+        self.metric = metric
+        self.records = []
+        self._start_time = None
+        self._start_metric_time = 0.0
+
+    def _metric_time(self):
+        return self.metric.time_spent if self.metric is not None else 0.0
+
+    def callbacks(self):
+        return [LGBMTelemetryHook(self, True), LGBMTelemetryHook(self, False)]
+
+    def start_iteration(self, env):
+        if env.iteration == env.begin_iteration:
+            self.records = []
+        self._start_time = time()
+        self._start_metric_time = self._metric_time()
+
+    def end_iteration(self, env):
+        self.records.append(
+            {
+                "iteration": env.iteration,
+                "wall_time": time() - self._start_time,
+                "metric_time": self._metric_time() - self._start_metric_time,
+            }
+        )
+
+    def summary(self):
+        df = pd.DataFrame.from_records(self.records)
+        if df.empty:
+            return df
+        totals = df[["wall_time", "metric_time"]].sum()
+        totals["metric_share"] = totals["metric_time"] / totals["wall_time"]
+        totals["iterations"] = len(df)
+        return totals
+
+
+def get_telemetry_records(model_fit_params):
+    """Helper function that returns a copy of the records of the
+    LGBMTelemetry in model_fit_params["callbacks"], or None."""
+    for callback in model_fit_params.get("callbacks") or []:
+        if isinstance(callback, LGBMTelemetryHook):
+            return list(callback.telemetry.records)
+    return None
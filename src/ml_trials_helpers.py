@@ -6,6 +6,8 @@ from time import time
 
 import lightgbm as lgb
 
+import src.memory_helpers as memh
+
 
 def train_lgbm_sklearn(
     model_params,
@@ -59,20 +61,30 @@ def model_train_predict_sklearn(
 
 
 def train_lgbm(
-    model_params, model_fit_params, lgbtrain, watchlist, model_scoring_func
+    model_params,
+    model_fit_params,
+    lgbtrain,
+    watchlist,
+    model_scoring_func,
+    categorical_feature="auto",
 ):
     print("Training LightGBM model started.")
     tr_start_time = time()
+    if hasattr(model_scoring_func, "reset"):
+        # Buffered metrics (LGBMSmape) must not report values of an
+        # earlier run, e.g. of another candidate on the same Dataset
+        model_scoring_func.reset()
     model = lgb.train(
         model_params,
         lgbtrain,
         num_boost_round=model_fit_params["num_boost_round"],
         early_stopping_rounds=model_fit_params["early_stopping_rounds"],
         feval=model_scoring_func,
-        # categorical_feature=categ_fea,
+        categorical_feature=categorical_feature,
         valid_sets=watchlist,
         valid_names=["train", "eval"],
         verbose_eval=200,
+        callbacks=model_fit_params.get("callbacks"),
     )
     tr_duration = time() - tr_start_time
     print(f"Training LightGBM model finished in {tr_duration:.2f} seconds.")
@@ -87,18 +99,35 @@ def model_train_predict(
     model_params,
     model_fit_params,
     scoring_func,
+    categorical_feature="auto",
+    dataset_manager=None,
+    memory_report=None,
 ):
-    lgbtrain = lgb.Dataset(
-        data=X_train,
-        label=y_train,
-        feature_name=feature_cols,
-        # categorical_feature=categ_fea,
-    )
+    if dataset_manager is None:
+        lgbtrain = lgb.Dataset(
+            data=X_train,
+            label=y_train,
+            feature_name=feature_cols,
+            categorical_feature=categorical_feature,
+        )
+    else:
+        # Reuse the binned Dataset of earlier candidates on the same fold
+        lgbtrain = dataset_manager.get_train_dataset(
+            X_train, y_train, feature_cols, model_params, categorical_feature
+        )
     watchlist = [lgbtrain]
 
-    model = train_lgbm(
-        model_params, model_fit_params, lgbtrain, watchlist, scoring_func
-    )
-    y_pred_test = model.predict(X_test)
+    with memh.track_stage("train_lgbm", memory_report, len(X_train)):
+        model = train_lgbm(
+            model_params,
+            model_fit_params,
+            lgbtrain,
+            watchlist,
+            scoring_func,
+            categorical_feature,
+        )
+    with memh.track_stage("predict", memory_report, len(X_test)) as stage:
+        y_pred_test = model.predict(X_test)
+        stage["rows_out"] = len(y_pred_test)
     print("Prediction made")
     return [y_pred_test, model]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import src.ml_helpers as mlh
+import src.ml_trials_helpers as mlth
+from src.ml_metrics import get_telemetry_records, smape
+from src.utils import get_cv_folds, get_thread_budget, prepare_fold_data
+
+# Preprocessed CV folds and the LGBDatasetManager (or None), shared by
+# every candidate evaluated in a process
+_FOLD_DATA = []
+_DATASET_MANAGER = None
+
+
+def _init_fold_data(fold_data, dataset_manager=None):
+    global _FOLD_DATA, _DATASET_MANAGER
+    _FOLD_DATA = fold_data
+    _DATASET_MANAGER = dataset_manager
+
+
+def get_rung_budgets(num_candidates, max_boost_round, eta=3):
+    """Return the number of boosting rounds used at each rung of successive
+    halving, ending with max_boost_round."""
+    num_rungs = 1
+    while num_candidates >= eta**num_rungs:
+        num_rungs += 1
+    return [
+        max(1, int(max_boost_round / eta ** (num_rungs - 1 - k)))
+        for k in range(num_rungs)
+    ]
+
+
+def train_score_fold(
+    fold_idx,
+    model_params,
+    model_fit_params,
+    scoring_func,
+):
+    fold = _FOLD_DATA[fold_idx]
+    y_pred_test, _ = mlth.model_train_predict(
+        fold["X_train"],
+        fold["X_test"],
+        fold["y_train"],
+        fold["feature_cols"],
+        model_params,
+        model_fit_params,
+        scoring_func,
+        fold["categorical_feature"],
+        _DATASET_MANAGER,
+    )
+    smape_score_test = smape(np.expm1(y_pred_test), fold["y_test"])
+    record = {
+        "fold": fold["fold"],
+        "model_params": model_params,
+        "model_params_str": str(model_params),
+        "train_end_date": fold["train_end_date"],
+        "test_start_date": fold["test_start_date"],
+        "test_end_date": fold["test_end_date"],
+        "smape": smape_score_test,
+    }
+    telemetry = get_telemetry_records(model_fit_params)
+    if telemetry is not None:
+        record["telemetry"] = telemetry
+    return record
+
+
+def successive_halving_search(
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params_all,
+    scoring_func,
+    model_fit_params,
+    eta=3,
+    n_jobs=1,
+    feature_cache=None,
+    features_once=True,
+    compact=False,
+    preprocessing="ohe_scale",
+    dataset_manager=None,
+    feature_n_jobs=1,
+):
+    """Search over model_params_all with successive halving.
+
+    CV folds are built and preprocessed once and reused by every candidate.
+    At each rung, all surviving candidates are trained on every fold with
+    the rung's num_boost_round, in parallel when n_jobs != 1, and only the
+    best 1/eta by mean SMAPE move on. The last rung uses the full
+    model_fit_params["num_boost_round"]. Pass features_once=False with
+    sliding-window CV (see get_cv_folds()).
+
+    Returns
+    -------
+    df_cv_summary : pd.DataFrame
+        Fold records of the candidates that reached the last rung, in the
+        format returned by score_model(), for get_best_model_hyper_params()
+    df_search_history : pd.DataFrame
+        Fold records of every rung, with rung and num_boost_round columns
+    """
+    fold_data = []
+    for r, train_df, test_df, fold_features in get_cv_folds(
+        data,
+        cv,
+        lags,
+        window_size,
+        used_columns,
+        first_date,
+        gap,
+        horizon,
+        feature_cache,
+        features_once,
+        compact,
+        feature_n_jobs=feature_n_jobs,
+    ):
+        (
+            X_train,
+            y_train,
+            X_test,
+            feature_cols,
+            train_end_date,
+            test_start_date,
+            test_end_date,
+            _,
+            test_keys,
+        ) = prepare_fold_data(
+            train_df,
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            r + 1,
+            first_date,
+            gap,
+            horizon,
+            test_df,
+            feature_cache,
+            fold_features,
+            compact,
+            preprocessing=preprocessing,
+            feature_n_jobs=feature_n_jobs,
+        )
+        fold_data.append(
+            {
+                "fold": r + 1,
+                "X_train": X_train,
+                "y_train": y_train,
+                "X_test": X_test,
+                # In the row order of X_test
+                "y_test": mlh.align_to_keys(
+                    test_df["sales"], test_df.reset_index(), test_keys
+                ),
+                "feature_cols": feature_cols,
+                "categorical_feature": (
+                    categ_fea if preprocessing == "tree_native" else "auto"
+                ),
+                "train_end_date": train_end_date,
+                "test_start_date": test_start_date,
+                "test_end_date": test_end_date,
+            }
+        )
+
+    budgets = get_rung_budgets(
+        len(model_params_all), model_fit_params["num_boost_round"], eta
+    )
+    n_workers, nthread = get_thread_budget(
+        n_jobs, len(model_params_all) * len(fold_data)
+    )
+    # Workers get the dataset manager once, not with every task, so that
+    # they reuse its Datasets across candidates
+    if n_workers == 1:
+        _init_fold_data(fold_data, dataset_manager)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_fold_data,
+            initargs=(fold_data, dataset_manager),
+        )
+
+    candidates = list(model_params_all)
+    history = []
+    try:
+        for rung, num_boost_round in enumerate(budgets):
+            fit_params = dict(
+                model_fit_params, num_boost_round=num_boost_round
+            )
+            tasks = [
+                (params, dict(params, nthread=nthread), k)
+                for params in candidates
+                for k in range(len(fold_data))
+            ]
+            if executor is None:
+                records = [
+                    train_score_fold(
+                        k,
+                        train_params,
+                        fit_params,
+                        scoring_func,
+                    )
+                    for _, train_params, k in tasks
+                ]
+            else:
+                futures = [
+                    executor.submit(
+                        train_score_fold,
+                        k,
+                        train_params,
+                        fit_params,
+                        scoring_func,
+                    )
+                    for _, train_params, k in tasks
+                ]
+                records = [f.result() for f in futures]
+            for (params, _, _), record in zip(tasks, records):
+                # Report the caller's params, not the thread-budgeted ones
+                record.update(
+                    model_params=params,
+                    model_params_str=str(params),
+                    rung=rung,
+                    num_boost_round=num_boost_round,
+                )
+            df_rung = pd.DataFrame.from_records(records)
+            history.append(df_rung)
+            print(
+                f"Rung {rung + 1}/{len(budgets)}: {len(candidates)} "
+                f"candidates, num_boost_round={num_boost_round}"
+            )
+            if rung == len(budgets) - 1:
+                break
+            mean_scores = df_rung.groupby("model_params_str", sort=False)[
+                "smape"
+            ].mean()
+            num_keep = max(1, int(math.ceil(len(candidates) / eta)))
+            keep = mean_scores.nsmallest(num_keep).index
+            candidates = [p for p in candidates if str(p) in keep]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    df_search_history = pd.concat(history, ignore_index=True)
+    df_cv_summary = history[-1].drop(columns=["rung", "num_boost_round"])
+    return [df_cv_summary, df_search_history]
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import src.feature_utils as ftu
+import src.memory_helpers as memh
+import src.ml_custom_transformers as mlct
+import src.ml_helpers as mlh
+import src.ml_trials_helpers as mlth
+from src.ml_metrics import smape
+from src.utils import build_features, get_cv_folds
+
+
+def write_feature_shards(
+    train_df,
+    lags,
+    window_size,
+    used_columns,
+    first_date,
+    gap,
+    horizon,
+    shard_dir,
+    series_batch_size=500,
+    compact=False,
+    memory_report=None,
+):
+    """Build features series_batch_size series at a time and write each
+    batch to a Parquet shard in shard_dir.
+
+    Features of a series only depend on that series, so the shards together
+    hold the same rows as build_features() on all of train_df. The train end
+    date is the one of train_df, not of each batch. Peak memory depends on
+    the batch size, not on the number of series.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    train_end_date = train_df.index.get_level_values(1).max()
+    shard_paths = []
+    for shard_num, (series, rows) in enumerate(
+        zip(*ftu.get_series_batches(train_df, series_batch_size))
+    ):
+        with memh.track_stage(
+            "feature_shard", memory_report, len(rows)
+        ) as stage:
+            features = build_features(
+                train_df.iloc[rows],
+                lags,
+                window_size,
+                used_columns,
+                first_date,
+                train_end_date,
+                gap,
+                horizon,
+                compact,
+                series=series,
+            )
+            shard_path = os.path.join(
+                shard_dir, f"shard-{shard_num:05d}.parquet"
+            )
+            features.to_parquet(shard_path, index=False)
+            shard_paths.append(shard_path)
+            stage["rows_out"] = len(features)
+    return [shard_paths, train_end_date]
+
+
+def iter_shard_splits(shard_paths, train_end_date, gap, columns=None):
+    """Yield the training rows and test rows of every shard, one shard at a
+    time."""
+    test_start_date = train_end_date + pd.DateOffset(days=gap + 1)
+    for shard_path in shard_paths:
+        features = pd.read_parquet(shard_path, columns=columns)
+        yield [
+            features[features["date"] <= train_end_date],
+            features[features["date"] >= test_start_date],
+        ]
+
+
+def fit_shard_preprocessor(
+    shard_paths, train_end_date, gap, categ_fea, compact
+):
+    """Fit the tree_native preprocessor on the categories of all shards,
+    reading only the date and categorical columns, and count the training
+    and test rows."""
+    n_train, n_test = 0, 0
+    categories = {c: set() for c in categ_fea}
+    for train_fea, test_fea in iter_shard_splits(
+        shard_paths, train_end_date, gap, ["date"] + categ_fea
+    ):
+        n_train += len(train_fea)
+        n_test += len(test_fea)
+        for c in categ_fea:
+            categories[c].update(train_fea[c].unique())
+    n_categories = max(len(v) for v in categories.values())
+    # Repeat categories to fill columns of equal length; the encoder only
+    # keeps the sorted unique values of each column
+    X_categories = pd.DataFrame(
+        {c: np.resize(sorted(v), n_categories) for c, v in categories.items()}
+    )
+    ordinal_encoder = mlct.DFOrdinalEncoder().fit(X_categories)
+    non_cats_enc = [
+        c
+        for c in pq.read_schema(shard_paths[0]).names
+        if c not in ["sales", "date"] + categ_fea
+    ]
+    fitted_preprocessor = {
+        "preprocessing": "tree_native",
+        "compact": compact,
+        "ordinal_encoder": ordinal_encoder,
+        "cats_enc": list(categ_fea),
+        "non_cats_enc": non_cats_enc,
+    }
+    return [fitted_preprocessor, n_train, n_test]
+
+
+def train_predict_from_shards(
+    shard_paths,
+    train_end_date,
+    gap,
+    categ_fea,
+    model_params,
+    model_fit_params,
+    scoring_func,
+    compact=False,
+    spill_dir=None,
+    memory_report=None,
+):
+    """Train LightGBM on feature shards and predict their test rows.
+
+    Shards are preprocessed one at a time (tree_native preprocessing, whose
+    categories are known without holding all rows) into on-disk memory maps
+    in spill_dir (a temporary directory by default), which LightGBM bins
+    without an in-memory copy of the raw feature matrix.
+
+    Returns the predictions, the model, the fitted preprocessor, the feature
+    columns and the store, item and date of every predicted row.
+    """
+    fitted_preprocessor, n_train, n_test = fit_shard_preprocessor(
+        shard_paths, train_end_date, gap, categ_fea, compact
+    )
+    feature_cols = (
+        fitted_preprocessor["cats_enc"] + fitted_preprocessor["non_cats_enc"]
+    )
+    fea_dtype = np.float32 if compact else np.float64
+    with TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        X_train, X_test = [
+            np.lib.format.open_memmap(
+                os.path.join(tmp_dir, f"X_{split}.npy"),
+                mode="w+",
+                dtype=fea_dtype,
+                shape=(n_rows, len(feature_cols)),
+            )
+            for split, n_rows in zip(["train", "test"], [n_train, n_test])
+        ]
+        y_train = np.empty(n_train, dtype=fea_dtype)
+        test_keys = []
+        train_pos, test_pos = 0, 0
+        with memh.track_stage(
+            "preprocess_shards", memory_report, n_train + n_test
+        ):
+            for train_fea, test_fea in iter_shard_splits(
+                shard_paths, train_end_date, gap
+            ):
+                X_train_shard, y_train_shard, X_test_shard = mlh.get_xy(
+                    train_fea, test_fea, "sales"
+                )
+                y_train_shard = mlh.transform_target(y_train_shard)
+                stop = train_pos + len(train_fea)
+                X_train[train_pos:stop] = mlh.apply_preprocessor(
+                    fitted_preprocessor, X_train_shard
+                )[feature_cols].to_numpy()
+                y_train[train_pos:stop] = y_train_shard.to_numpy()
+                train_pos = stop
+                stop = test_pos + len(test_fea)
+                X_test[test_pos:stop] = mlh.apply_preprocessor(
+                    fitted_preprocessor, X_test_shard
+                )[feature_cols].to_numpy()
+                test_pos = stop
+                test_keys.append(test_fea[["store", "item", "date"]])
+        y_pred_test, model = mlth.model_train_predict(
+            X_train,
+            X_test,
+            y_train,
+            feature_cols,
+            model_params,
+            model_fit_params,
+            scoring_func,
+            categ_fea,
+            memory_report=memory_report,
+        )
+        del X_train, X_test
+    test_keys = pd.concat(test_keys, ignore_index=True)
+    return [y_pred_test, model, fitted_preprocessor, feature_cols, test_keys]
+
+
+def score_fold_from_shards(
+    r,
+    train_df,
+    test_df,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params,
+    shard_dir,
+    series_batch_size=500,
+    compact=False,
+    memory_report=None,
+):
+    """Score one CV fold out of core, with the feature shards of the fold
+    written to (and removed from) a subdirectory of shard_dir; the record
+    has the fields of a score_fold() record."""
+    print("---------- Round " + str(r + 1) + " (shards) ----------")
+    fold_dir = os.path.join(shard_dir, f"fold-{r + 1:03d}")
+    try:
+        shard_paths, train_end_date = write_feature_shards(
+            train_df,
+            lags,
+            window_size,
+            used_columns,
+            first_date,
+            gap,
+            horizon,
+            fold_dir,
+            series_batch_size,
+            compact,
+            memory_report,
+        )
+        y_pred_test, _, _, _, test_keys = train_predict_from_shards(
+            shard_paths,
+            train_end_date,
+            gap,
+            categ_fea,
+            model_params,
+            model_fit_params,
+            scoring_func,
+            compact,
+            memory_report=memory_report,
+        )
+    finally:
+        shutil.rmtree(fold_dir, ignore_errors=True)
+    with memh.track_stage("score", memory_report, len(test_df)):
+        # Shards hold the test rows in shard order, not in test_df order
+        y_pred_test = np.expm1(
+            mlh.align_to_keys(y_pred_test, test_keys, test_df.reset_index())
+        )
+        smape_score_test = smape(y_pred_test, test_df["sales"].to_numpy())
+    print("SMAPE of the predictions is {}".format(smape_score_test))
+    return {
+        "fold": r + 1,
+        "model_params": model_params,
+        "model_params_str": str(model_params),
+        "train_end_date": train_end_date,
+        "test_start_date": test_keys["date"].min().strftime("%Y-%m-%d"),
+        "test_end_date": test_keys["date"].max().strftime("%Y-%m-%d"),
+        "smape": smape_score_test,
+    }
+
+
+def score_model_from_shards(
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params,
+    shard_dir,
+    series_batch_size=500,
+    compact=False,
+    memory_report=None,
+):
+    """Out-of-core counterpart of score_model() with tree_native
+    preprocessing: every fold builds its features series_batch_size series
+    at a time into feature shards, one fold after the other.
+
+    Stage records are appended to memory_report, tagged with the fold
+    number, as in score_model().
+    """
+    scoring_records_summary = []
+    for r, train_df, test_df, _ in get_cv_folds(
+        data, cv, lags, window_size, used_columns, first_date, gap, horizon
+    ):
+        fold_report = None if memory_report is None else []
+        scoring_records_summary.append(
+            score_fold_from_shards(
+                r,
+                train_df,
+                test_df,
+                lags,
+                window_size,
+                used_columns,
+                categ_fea,
+                first_date,
+                gap,
+                horizon,
+                model_params,
+                scoring_func,
+                model_fit_params,
+                shard_dir,
+                series_batch_size,
+                compact,
+                fold_report,
+            )
+        )
+        if memory_report is not None:
+            memory_report.extend(
+                dict(record, fold=r + 1) for record in fold_report
+            )
+    return scoring_records_summary
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src.artifact_helpers import save_artifacts
+from src.inference_helpers import (
+    get_feature_config,
+    get_future_prediction_data_grid,
+    predict_future_from_artifacts,
+    show_future_prediction_data_dates,
+)
+from src.ml_helpers import align_to_keys
+from src.ml_metrics import smape
+from src.utils import (
+    create_features_train_predict,
+    get_cv_folds,
+    get_thread_budget,
+    score_fold,
+)
+
+SHARD_INDEX_FILE_NAME = "shards.joblib"
+
+
+def get_shard_map(data, shard_by="store"):
+    """Map every series (symbol) of data to its shard.
+
+    shard_by is either a column of data that is constant within a series,
+    e.g. "store" for one model per store, or a dict or Series mapping every
+    symbol to a custom group.
+    """
+    symbols = data.index.get_level_values("symbol")
+    if isinstance(shard_by, str):
+        first_rows = ~symbols.duplicated()
+        shard_map = pd.Series(
+            data[shard_by].to_numpy()[first_rows],
+            index=symbols[first_rows],
+            name="shard",
+        )
+    else:
+        shard_map = pd.Series(shard_by, name="shard")
+    missing = symbols.unique().difference(shard_map.index)
+    assert len(missing) == 0, f"Series without a shard: {list(missing[:5])}"
+    return shard_map
+
+
+def get_shard_rows(df, shard_map):
+    "Helper function that returns the row positions of df in every shard."
+    shards = shard_map.reindex(df.index.get_level_values("symbol"))
+    assert not shards.isna().any(), "Series without a shard"
+    return pd.DataFrame({"shard": shards.to_numpy()}).groupby("shard").indices
+
+
+def train_predict_shard(
+    shard,
+    data_train,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    fold_num,
+    first_date,
+    gap,
+    horizon,
+    data_test,
+    model_params,
+    model_fit_params,
+    scoring_func,
+    compact=False,
+    preprocessing="ohe_scale",
+    train_end_date=None,
+):
+    """Train and predict the series of one shard with
+    create_features_train_predict(); returns the results in a dict.
+
+    train_end_date should be the one of all series, since the series of a
+    shard may end earlier.
+    """
+    start_time = time()
+    print(f"Shard {shard}: {len(data_train)} training rows")
+    (
+        X_test,
+        y_pred_test,
+        model,
+        train_end_date,
+        test_start_date,
+        test_end_date,
+        fitted_preprocessor,
+        test_keys,
+    ) = create_features_train_predict(
+        data_train,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        fold_num,
+        first_date,
+        gap,
+        horizon,
+        data_test,
+        model_params,
+        model_fit_params,
+        scoring_func,
+        compact=compact,
+        preprocessing=preprocessing,
+        return_fold_info=True,
+        train_end_date=train_end_date,
+    )
+    return {
+        "shard": shard,
+        "y_pred_test": y_pred_test,
+        "model": model,
+        "fitted_preprocessor": fitted_preprocessor,
+        "feature_cols": list(X_test),
+        "test_keys": test_keys,
+        "train_end_date": train_end_date,
+        "test_start_date": test_start_date,
+        "test_end_date": test_end_date,
+        "wall_s": time() - start_time,
+    }
+
+
+def train_predict_sharded(
+    data_train,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    fold_num,
+    first_date,
+    gap,
+    horizon,
+    data_test,
+    model_params,
+    model_fit_params,
+    scoring_func,
+    shard_map,
+    n_jobs=1,
+    compact=False,
+    preprocessing="ohe_scale",
+):
+    """Train one model per shard of shard_map, n_jobs shards at a time, and
+    predict the test rows of every shard.
+
+    Returns the results of train_predict_shard() in shard order and the row
+    positions of every shard in data_test (None if data_test is empty, as
+    when forecasting the future). Every shard uses the train end date of
+    all of data_train, so all shards predict the same dates.
+    """
+    train_end_date = data_train.index.get_level_values(1).max()
+    train_rows = get_shard_rows(data_train, shard_map)
+    test_rows = None
+    if not data_test.empty:
+        test_rows = get_shard_rows(data_test, shard_map)
+        assert set(test_rows) <= set(train_rows)
+    shard_args = [
+        [
+            shard,
+            data_train.iloc[rows],
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            fold_num,
+            first_date,
+            gap,
+            horizon,
+            (
+                pd.DataFrame()
+                if test_rows is None
+                else data_test.iloc[test_rows[shard]]
+            ),
+        ]
+        for shard, rows in train_rows.items()
+    ]
+    fit_args = [model_params, model_fit_params, scoring_func, compact]
+    if n_jobs == 1:
+        shard_results = [
+            train_predict_shard(
+                *args, *fit_args, preprocessing, train_end_date
+            )
+            for args in shard_args
+        ]
+    else:
+        n_workers, nthread = get_thread_budget(n_jobs, len(shard_args))
+        fit_args[0] = dict(model_params, nthread=nthread)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(
+                    train_predict_shard,
+                    *args,
+                    *fit_args,
+                    preprocessing,
+                    train_end_date,
+                )
+                for args in shard_args
+            ]
+            shard_results = [f.result() for f in futures]
+    return [shard_results, test_rows]
+
+
+def score_fold_sharded(
+    r,
+    train_df,
+    test_df,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params,
+    shard_map,
+    n_jobs=1,
+    compact=False,
+    preprocessing="ohe_scale",
+):
+    """Score one CV fold with one model per shard; the record has the
+    fields of a score_fold() record, with the SMAPE of all shards' test
+    rows together, plus the SMAPE of every shard and the wall time."""
+    print("---------- Round " + str(r + 1) + " (sharded) ----------")
+    start_time = time()
+    shard_results, test_rows = train_predict_sharded(
+        train_df,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        r + 1,
+        first_date,
+        gap,
+        horizon,
+        test_df,
+        model_params,
+        model_fit_params,
+        scoring_func,
+        shard_map,
+        n_jobs,
+        compact,
+        preprocessing,
+    )
+    y_pred_test = np.empty(len(test_df))
+    y_test = test_df["sales"].to_numpy()
+    shard_smape = {}
+    for result in shard_results:
+        rows = test_rows[result["shard"]]
+        # Predictions are matched to test_df rows by store, item and date
+        y_pred_test[rows] = np.expm1(
+            align_to_keys(
+                result["y_pred_test"],
+                result["test_keys"],
+                test_df.iloc[rows].reset_index(),
+            )
+        )
+        shard_smape[result["shard"]] = smape(y_pred_test[rows], y_test[rows])
+    smape_score_test = smape(y_pred_test, y_test)
+    print("SMAPE of the sharded predictions is {}".format(smape_score_test))
+    return {
+        "fold": r + 1,
+        "model_params": model_params,
+        "model_params_str": str(model_params),
+        "train_end_date": shard_results[0]["train_end_date"],
+        "test_start_date": shard_results[0]["test_start_date"],
+        "test_end_date": shard_results[0]["test_end_date"],
+        "smape": smape_score_test,
+        "n_shards": len(shard_results),
+        "shard_smape": shard_smape,
+        "wall_s": time() - start_time,
+    }
+
+
+def score_model_sharded(
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params={"early_stoppin_rounds": 200, "verbose": 0},
+    shard_by="store",
+    n_jobs=1,
+    compact=False,
+    preprocessing="ohe_scale",
+):
+    """Score model_params with cross-validation, training one model per
+    shard of shard_by (see get_shard_map()) on every fold. Folds run one
+    after the other, the shards of a fold n_jobs at a time."""
+    shard_map = get_shard_map(data, shard_by)
+    fold_args = get_cv_folds(
+        data, cv, lags, window_size, used_columns, first_date, gap, horizon
+    )
+    return [
+        score_fold_sharded(
+            r,
+            train_df,
+            test_df,
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            first_date,
+            gap,
+            horizon,
+            model_params,
+            scoring_func,
+            model_fit_params,
+            shard_map,
+            n_jobs,
+            compact,
+            preprocessing,
+        )
+        for r, train_df, test_df, _ in fold_args
+    ]
+
+
+def compare_sharded_to_global(
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params={"early_stoppin_rounds": 200, "verbose": 0},
+    shard_by="store",
+    n_jobs=1,
+    compact=False,
+    preprocessing="ohe_scale",
+):
+    """Score the global model and the sharded models on the same CV folds.
+
+    The global model of a fold trains with all cores; the shards of a fold
+    train n_jobs at a time, splitting the cores between them (see
+    get_thread_budget()). Returns one row per fold with the SMAPE and wall
+    time of both, to trade accuracy against training time.
+    """
+    num_splits = cv.get_n_splits(X=data.iloc[:2], y=data.iloc[2])
+    shard_map = get_shard_map(data, shard_by)
+    fold_args = get_cv_folds(
+        data, cv, lags, window_size, used_columns, first_date, gap, horizon
+    )
+    comparison = []
+    for r, train_df, test_df, _ in fold_args:
+        start_time = time()
+        global_record = score_fold(
+            r,
+            train_df,
+            test_df,
+            num_splits,
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            first_date,
+            gap,
+            horizon,
+            model_params,
+            scoring_func,
+            model_fit_params,
+            compact=compact,
+            preprocessing=preprocessing,
+        )
+        global_wall_s = time() - start_time
+        sharded_record = score_fold_sharded(
+            r,
+            train_df,
+            test_df,
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            first_date,
+            gap,
+            horizon,
+            model_params,
+            scoring_func,
+            model_fit_params,
+            shard_map,
+            n_jobs,
+            compact,
+            preprocessing,
+        )
+        comparison.append(
+            {
+                "fold": r + 1,
+                "n_shards": sharded_record["n_shards"],
+                "smape_global": global_record["smape"],
+                "smape_sharded": sharded_record["smape"],
+                "wall_s_global": global_wall_s,
+                "wall_s_sharded": sharded_record["wall_s"],
+            }
+        )
+    return pd.DataFrame.from_records(comparison)
+
+
+def predict_future_sharded(
+    r,
+    data_train,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    data_test,
+    model_params,
+    scoring_func,
+    model_fit_params={"early_stoppin_rounds": 200, "verbose": 0},
+    shard_by="store",
+    n_jobs=1,
+    compact=False,
+    preprocessing="ohe_scale",
+    artifact_dir=None,
+):
+    """Train one model per shard of shard_by on all of data_train and
+    forecast the horizon after the gap, as predict_future() does with one
+    global model. Returns the models in a dict keyed by shard.
+
+    If artifact_dir is given, every shard's artifacts are saved in a
+    shard=<shard> subdirectory, next to a shard index that
+    predict_future_from_sharded_artifacts() routes series with.
+    """
+    show_future_prediction_data_dates(data_train, gap)
+    shard_map = get_shard_map(data_train, shard_by)
+    shard_results, _ = train_predict_sharded(
+        data_train,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        r,
+        first_date,
+        gap,
+        horizon,
+        data_test,
+        model_params,
+        model_fit_params,
+        scoring_func,
+        shard_map,
+        n_jobs,
+        compact,
+        preprocessing,
+    )
+    train_rows = get_shard_rows(data_train, shard_map)
+    shard_preds = []
+    for result in shard_results:
+        shard_pred = get_future_prediction_data_grid(
+            data_train.iloc[train_rows[result["shard"]]],
+            gap,
+            horizon,
+            result["train_end_date"],
+        )
+        shard_pred["pred"] = np.expm1(
+            align_to_keys(
+                result["y_pred_test"],
+                result["test_keys"],
+                shard_pred.reset_index(),
+            )
+        )
+        shard_preds.append(shard_pred)
+    df_future_pred = get_future_prediction_data_grid(data_train, gap, horizon)
+    df_future_pred["pred"] = pd.concat(shard_preds)["pred"].reindex(
+        df_future_pred.index
+    )
+    assert not df_future_pred["pred"].isna().any()
+    if artifact_dir is not None:
+        feature_config = get_feature_config(
+            lags,
+            window_size,
+            used_columns,
+            categ_fea,
+            first_date,
+            gap,
+            horizon,
+            compact,
+            preprocessing,
+        )
+        shard_dirs = {}
+        for result in shard_results:
+            shard_dirs[result["shard"]] = f"shard={result['shard']}"
+            save_artifacts(
+                os.path.join(artifact_dir, shard_dirs[result["shard"]]),
+                result["model"],
+                result["fitted_preprocessor"],
+                result["feature_cols"],
+                feature_config,
+                result["train_end_date"],
+            )
+        joblib.dump(
+            {
+                "shard_map": shard_map,
+                "shard_dirs": shard_dirs,
+                "gap": gap,
+                "horizon": horizon,
+            },
+            os.path.join(artifact_dir, SHARD_INDEX_FILE_NAME),
+        )
+    return [
+        df_future_pred,
+        {result["shard"]: result["model"] for result in shard_results},
+        shard_results[0]["train_end_date"],
+        shard_results[0]["test_start_date"],
+        shard_results[0]["test_end_date"],
+    ]
+
+
+def predict_future_from_sharded_artifacts(
+    data_train, artifact_dir, feature_cache=None
+):
+    """Forecast with the shard models saved by
+    predict_future_sharded(..., artifact_dir=...), without retraining.
+
+    Every series of data_train is routed to the model of its shard; series
+    that were not in any shard at training time raise an AssertionError.
+    """
+    shard_index = joblib.load(
+        os.path.join(artifact_dir, SHARD_INDEX_FILE_NAME)
+    )
+    train_rows = get_shard_rows(data_train, shard_index["shard_map"])
+    # Shards whose series end earlier still forecast the same dates
+    train_end_date = data_train.index.get_level_values(1).max()
+    shard_preds, models = [], {}
+    for shard, rows in train_rows.items():
+        (
+            shard_pred,
+            models[shard],
+            _,
+            test_start_date_manual,
+            test_end_date_manual,
+        ) = predict_future_from_artifacts(
+            data_train.iloc[rows],
+            os.path.join(artifact_dir, shard_index["shard_dirs"][shard]),
+            feature_cache,
+            train_end_date,
+        )
+        shard_preds.append(shard_pred)
+    df_future_pred = get_future_prediction_data_grid(
+        data_train, shard_index["gap"], shard_index["horizon"]
+    )
+    df_future_pred["pred"] = pd.concat(shard_preds)["pred"].reindex(
+        df_future_pred.index
+    )
+    assert not df_future_pred["pred"].isna().any()
+    return [
+        df_future_pred,
+        models,
+        train_end_date,
+        test_start_date_manual,
+        test_end_date_manual,
+    ]
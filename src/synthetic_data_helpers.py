@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+
+from src.data_helpers import write_partitioned_parquet
+
+
+def make_sales_block(
+    n_series,
+    n_days,
+    rng,
+    trend_scale=0.3,
+    weekly_scale=0.25,
+    yearly_scale=0.3,
+    intermittent_frac=0.1,
+    zero_prob=0.6,
+    day_offset=0,
+):
+    """Simulate daily sales of n_series series as an (n_series, n_days) block.
+
+    Every series has its own level, linear trend, weekly and yearly
+    seasonality and Poisson noise. A fraction intermittent_frac of the
+    series are intermittent, with zero sales on a share zero_prob of days.
+    """
+    t = np.arange(day_offset, day_offset + n_days)
+    level = rng.lognormal(mean=3.0, sigma=0.6, size=(n_series, 1))
+    trend = rng.uniform(-trend_scale, trend_scale, size=(n_series, 1))
+    weekly_phase = rng.uniform(0, 2 * np.pi, size=(n_series, 1))
+    yearly_phase = rng.uniform(0, 2 * np.pi, size=(n_series, 1))
+    mean_sales = (
+        level
+        * (1 + trend * t / 365)
+        * (1 + weekly_scale * np.sin(2 * np.pi * t / 7 + weekly_phase))
+        * (1 + yearly_scale * np.sin(2 * np.pi * t / 365 + yearly_phase))
+    )
+    sales = rng.poisson(np.clip(mean_sales, 0, None))
+    intermittent = rng.random(n_series) < intermittent_frac
+    zero_days = rng.random((int(intermittent.sum()), n_days)) < zero_prob
+    sales[intermittent] = np.where(zero_days, 0, sales[intermittent])
+    return sales
+
+
+def make_synthetic_sales(
+    n_stores=10,
+    n_items=50,
+    n_days=1826,
+    start_date="2013-01-01",
+    seed=42,
+    **block_kwargs,
+):
+    """Generate store-item daily sales shaped like the Kaggle training data.
+
+    Returns a DataFrame indexed by (symbol, date) with store, item and
+    sales columns, rows ordered by store, item and date. block_kwargs are
+    passed to make_sales_block().
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start_date, periods=n_days)
+    sales = make_sales_block(n_stores * n_items, n_days, rng, **block_kwargs)
+    stores = np.repeat(np.arange(1, n_stores + 1), n_items)
+    items = np.tile(np.arange(1, n_items + 1), n_stores)
+    # Symbols are built once per series, not once per row
+    symbol = pd.Index(stores.astype(str)) + "_" + items.astype(str)
+    df = pd.DataFrame(
+        {
+            "store": np.repeat(stores, n_days),
+            "item": np.repeat(items, n_days),
+            "sales": sales.ravel(),
+        },
+        index=pd.MultiIndex.from_product(
+            [symbol, dates], names=["symbol", "date"]
+        ),
+    )
+    return df
+
+
+def write_synthetic_sales(
+    root_dir,
+    n_stores=10,
+    n_items=50,
+    n_days=1826,
+    start_date="2013-01-01",
+    seed=42,
+    stores_per_batch=10,
+    **block_kwargs,
+):
+    """Write synthetic sales too large for memory as a Parquet dataset
+    partitioned by store, generating stores_per_batch stores at a time.
+
+    Read it back with data_helpers.load_partitioned_parquet().
+    """
+    for batch_num, first_store in enumerate(
+        range(0, n_stores, stores_per_batch)
+    ):
+        n_batch_stores = min(stores_per_batch, n_stores - first_store)
+        df = make_synthetic_sales(
+            n_batch_stores,
+            n_items,
+            n_days,
+            start_date,
+            seed + batch_num,
+            **block_kwargs,
+        )
+        df["store"] += first_store
+        write_partitioned_parquet(
+            df.reset_index().drop(columns="symbol"),
+            root_dir,
+            partition_by="store",
+        )
@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 
 
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
 from time import time
 
 import numpy as np
@@ -10,76 +13,255 @@ from sklearn.pipeline import Pipeline
 
 import src.data_custom_transformers as ct
 import src.feature_utils as ut
+import src.memory_helpers as memh
 import src.ml_helpers as mlh
 import src.ml_trials_helpers as mlth
 from src.cv_helpers import show_cv_dates
-from src.ml_metrics import smape
+from src.ml_metrics import get_telemetry_records, smape
 
 
-def create_features(
+def build_features(
     train_df,
     lags,
     window_size,
     used_columns,
-    pred_round,
     first_date,
+    train_end_date,
     gap,
     horizon,
-    test_df=None,
+    compact=False,
+    memory_report=None,
+    imputation_report=None,
+    series=None,
 ):
-    store_list = train_df["store"].unique()
-    item_list = train_df["item"].unique()
-    train_end_date = train_df.index.get_level_values(1).max()
-    date_list = (
-        pd.date_range(
-            start=first_date,
-            end=train_end_date + pd.DateOffset(days=gap + horizon),
-        )
-        .strftime("%Y-%m-%d")
-        .tolist()
-    )
-    d = {"store": store_list, "item": item_list, "date": date_list}
-    data_grid = ut.df_from_cartesian_product(d)
-    data_grid["date"] = pd.to_datetime(data_grid["date"], format="%Y-%m-%d")
-    start_time = time()
-    data_filled = pd.merge(
-        data_grid,
-        train_df.reset_index().drop(columns="symbol"),
-        how="left",
-        on=["store", "item", "date"],
-    )
-
-    data_filled = data_filled.groupby(["store", "item"]).apply(
-        lambda x: x.fillna(method="ffill").fillna(method="bfill")
+    fea_dtype = np.float32 if compact else float
+    date_list = pd.date_range(
+        start=first_date,
+        end=train_end_date + pd.DateOffset(days=gap + horizon),
     )
+    with memh.track_stage(
+        "grid_merge_fill", memory_report, len(train_df)
+    ) as stage:
+        # Store-item pairs without sales would only give rows of missing
+        # values that dropna() removes, so the grid only has present pairs
+        if series is None:
+            _, series = ut.get_series_codes(train_df, ["store", "item"])
+        data_grid = ut.df_from_series_product(series, date_list)
+        train_data = train_df.reset_index().drop(columns="symbol")
+        if compact:
+            data_grid = memh.downcast_ints(data_grid, ["store", "item"])
+            train_data = memh.compact_raw_data(train_data)
+        data_filled = pd.merge(
+            data_grid,
+            train_data,
+            how="left",
+            on=["store", "item", "date"],
+        )
 
-    add_datepart_pipe = Pipeline(
-        [
-            ("adddatepart", ct.DFAddDatePart("date", False, False)),
+        fill_cols = [
+            c for c in data_filled if c not in ["store", "item", "date"]
         ]
-    )
-    data_filled = add_datepart_pipe.fit_transform(data_filled)
-    datetime_attr_cols = data_filled.columns[
-        ~data_filled.columns.str.contains("|".join(used_columns))
-    ].tolist()
-    assert list(data_filled) == used_columns + datetime_attr_cols
+        # Gap and horizon dates are always missing and not imputed sales
+        data_filled, imputed = ut.fill_series_gaps(
+            data_filled, fill_cols, count_until=train_end_date
+        )
+        if imputation_report is not None:
+            imputation_report.append(imputed)
+        stage["rows_out"] = len(data_filled)
+
+    with memh.track_stage(
+        "add_datepart", memory_report, len(data_filled)
+    ) as stage:
+        add_datepart_pipe = Pipeline(
+            [
+                ("adddatepart", ct.DFAddDatePart("date", False, False)),
+            ]
+        )
+        data_filled = add_datepart_pipe.fit_transform(data_filled)
+        datetime_attr_cols = data_filled.columns[
+            ~data_filled.columns.str.contains("|".join(used_columns))
+        ].tolist()
+        assert list(data_filled) == used_columns + datetime_attr_cols
+        if compact:
+            data_filled[datetime_attr_cols] = data_filled[
+                datetime_attr_cols
+            ].astype(fea_dtype)
+        stage["rows_out"] = len(data_filled)
 
-    features = data_filled.groupby(["store", "item"]).apply(
-        lambda x: ut.combine_features(
-            x,
+    with memh.track_stage(
+        "lag_features", memory_report, len(data_filled)
+    ) as stage:
+        features = ut.combine_features_vectorized(
+            data_filled,
             ["sales"],
             lags,
             window_size,
             list(data_filled),
+            dtype=fea_dtype,
         )
+        # print(list(features))
+
+        features.dropna(inplace=True)
+        # Date order lets fold splits slice rows by binary search; the row
+        # labels, and the series order within a date, are kept
+        features = features.sort_values("date", kind="stable")
+        stage["rows_out"] = len(features)
+    if memory_report is not None:
+        print(f"Features: {memh.frame_memory_mb(features):.1f} MB")
+    return features
+
+
+def build_features_batch(train_df, series, feature_args):
+    "Helper function that builds the features of one batch of series."
+    imputation_report = []
+    features = build_features(
+        train_df,
+        *feature_args,
+        imputation_report=imputation_report,
+        series=series,
     )
-    # print(list(features))
+    return [features, imputation_report[0]]
 
-    features.dropna(inplace=True)
+
+def build_features_parallel(
+    train_df,
+    lags,
+    window_size,
+    used_columns,
+    first_date,
+    train_end_date,
+    gap,
+    horizon,
+    compact=False,
+    memory_report=None,
+    imputation_report=None,
+    n_jobs=-1,
+    series_batch_size=None,
+):
+    """Build the same features as build_features(), with batches of series
+    built in a pool of up to n_jobs processes (all cores if n_jobs < 0).
+
+    Features of a series only depend on that series, so the batches are
+    relabelled with the row labels of the serial path and concatenated in
+    the same date, then series order. By default every worker gets one
+    batch.
+    """
+    row_codes, series = ut.get_series_codes(train_df, ["store", "item"])
+    n_workers, _ = get_thread_budget(n_jobs, len(series))
+    if series_batch_size is None:
+        series_batch_size = -(-len(series) // n_workers)
+    batch_series, batch_rows = ut.get_series_batches(
+        train_df, series_batch_size
+    )
+    feature_args = [
+        lags,
+        window_size,
+        used_columns,
+        first_date,
+        train_end_date,
+        gap,
+        horizon,
+        compact,
+    ]
+    n_dates = len(
+        pd.date_range(
+            start=first_date,
+            end=train_end_date + pd.DateOffset(days=gap + horizon),
+        )
+    )
+    with memh.track_stage(
+        "build_features_parallel", memory_report, len(train_df)
+    ) as stage:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(
+                    build_features_batch,
+                    train_df.iloc[rows],
+                    batch_series_keys,
+                    feature_args,
+                )
+                for batch_series_keys, rows in zip(batch_series, batch_rows)
+            ]
+            batch_results = [f.result() for f in futures]
+        first_series = np.cumsum([0] + [len(b) for b in batch_series[:-1]])
+        for (features, _), first in zip(batch_results, first_series):
+            # Grid rows of a batch start after those of earlier batches
+            features.index += first * n_dates
+        features = pd.concat([f for f, _ in batch_results]).sort_values(
+            "date", kind="stable"
+        )
+        stage["rows_out"] = len(features)
+    if imputation_report is not None:
+        imputation_report.append(
+            pd.concat([imp for _, imp in batch_results], ignore_index=True)
+        )
+    return features
+
+
+def create_features(
+    train_df,
+    lags,
+    window_size,
+    used_columns,
+    pred_round,
+    first_date,
+    gap,
+    horizon,
+    test_df=None,
+    feature_cache=None,
+    compact=False,
+    memory_report=None,
+    imputation_report=None,
+    feature_n_jobs=1,
+    train_end_date=None,
+    cv_audit=False,
+):
+    # A subset of the series, e.g. a shard, may end before the other series
+    if train_end_date is None:
+        train_end_date = train_df.index.get_level_values(1).max()
+    start_time = time()
+    feature_args = [
+        train_df,
+        lags,
+        window_size,
+        used_columns,
+        first_date,
+        train_end_date,
+        gap,
+        horizon,
+        compact,
+        memory_report,
+        imputation_report,
+    ]
+    # Cache hits do not append to imputation_report
+    build_func = build_features
+    if feature_n_jobs != 1:
+        build_func = partial(build_features_parallel, n_jobs=feature_n_jobs)
+    with memh.track_stage(
+        "create_features", memory_report, len(train_df)
+    ) as stage:
+        if feature_cache is None:
+            features = build_func(*feature_args)
+        else:
+            cache_key = feature_cache.make_key(
+                train_df,
+                lags=lags,
+                window_size=window_size,
+                used_columns=used_columns,
+                first_date=first_date,
+                gap=gap,
+                horizon=horizon,
+                compact=compact,
+                train_end_date=train_end_date,
+            )
+            features = feature_cache.get_or_create(
+                cache_key, lambda: build_func(*feature_args)
+            )
+        stage["rows_out"] = len(features)
     duration = time() - start_time
 
     if not test_df.empty:
-        show_cv_dates(pred_round, train_df, test_df, duration)
+        show_cv_dates(pred_round, train_df, test_df, duration, gap, cv_audit)
 
     # if pred_round == 0:
     #     # display(data_filled)
@@ -88,32 +270,187 @@ def create_features(
     return features, train_end_date
 
 
-def create_features_train_predict(
-    data_train,
+def check_fold_leakage(
+    fold_features,
+    train_df,
     lags,
     window_size,
     used_columns,
-    categ_fea,
-    fold_num,
     first_date,
     gap,
     horizon,
-    data_test,
-    model_params,
-    model_fit_params,
-    scoring_func,
+    compact=False,
 ):
-    features, train_end_date = create_features(
-        data_train,
+    """Check that no feature of a CV fold uses sales after the fold's train
+    end date.
+
+    The fold's features are recomputed with build_features() from train_df
+    only, as in the per-fold path, and both the training and test rows of
+    fold_features must match them, e.g. no series is back-filled from sales
+    after the train end date.
+    """
+    keys = ["store", "item", "date"]
+    train_end_date = train_df.index.get_level_values(1).max()
+    expected = build_features(
+        train_df,
         lags,
         window_size,
         used_columns,
-        fold_num,
         first_date,
+        train_end_date,
         gap,
         horizon,
-        data_test,
+        compact,
+    )
+    # Gap rows are not part of a fold
+    expected = expected[
+        (expected["date"] <= train_end_date)
+        | (expected["date"] > train_end_date + pd.DateOffset(days=gap))
+    ].set_index(keys)
+    actual = fold_features.set_index(keys)
+    assert len(actual) == len(expected), (
+        f"Fold has {len(actual)} feature rows, "
+        f"{len(expected)} from training sales only"
+    )
+    expected = expected.reindex(actual.index)[list(actual)]
+    is_train = actual.index.get_level_values("date") <= train_end_date
+    for split, mask in zip(["training", "test"], [is_train, ~is_train]):
+        pd.testing.assert_frame_equal(
+            actual[mask],
+            expected[mask],
+            check_dtype=False,
+            obj=f"{split} rows of the fold ending {train_end_date.date()}",
+        )
+
+
+def get_fold_features(
+    full_features,
+    train_df,
+    lags,
+    window_size,
+    first_date,
+    gap,
+    horizon,
+    used_columns=None,
+    compact=False,
+    check_leakage=False,
+):
+    """Slice one expanding-window CV fold out of a full-history feature table.
+
+    Only series with training sales are kept. Their training rows (date <=
+    the fold's train end date) only depend on sales up to their own date,
+    so they are taken from the full-history table unchanged. The sales, lag
+    and moving average columns of the fold's test rows are recomputed from
+    the fold's training sales only, forward-filled over the gap and horizon
+    as in create_features(). Sliding windows are not supported, see
+    get_cv_folds(). check_leakage compares the fold with features built
+    from train_df alone (see check_fold_leakage()), which costs as much as
+    the per-fold path.
+    """
+    train_end_date = train_df.index.get_level_values(1).max()
+    test_start_date = train_end_date + pd.DateOffset(days=gap + 1)
+    test_end_date = train_end_date + pd.DateOffset(days=gap + horizon)
+    dates = full_features["date"]
+    # Series that start after the train end date have no training sales;
+    # their rows in the full-history table are back-filled from the future
+    train_sales = train_df.reset_index()
+    series_keys = pd.MultiIndex.from_frame(
+        train_sales[["store", "item"]]
+    ).unique()
+    fold_mask = (
+        (dates <= train_end_date)
+        | ((dates >= test_start_date) & (dates <= test_end_date))
+    ) & pd.MultiIndex.from_frame(full_features[["store", "item"]]).isin(
+        series_keys
+    )
+    # One copy of the fold rows, not a boolean slice plus a copy of it
+    fold_features = full_features.take(np.flatnonzero(fold_mask))
+
+    # Dense (series, date) block of the fold's training sales
+    fold_dates = pd.date_range(first_date, test_end_date)
+    block = np.full(
+        (len(series_keys), len(fold_dates)),
+        np.nan,
+        dtype=fold_features["sales"].dtype,
+    )
+    block[
+        series_keys.get_indexer(
+            pd.MultiIndex.from_frame(train_sales[["store", "item"]])
+        ),
+        fold_dates.get_indexer(train_sales["date"]),
+    ] = train_sales["sales"].to_numpy(float)
+    block = ut.fill_block(block)
+
+    test_mask = (fold_features["date"] > train_end_date).to_numpy()
+    test_rows = fold_features[test_mask]
+    series_codes = series_keys.get_indexer(
+        pd.MultiIndex.from_frame(test_rows[["store", "item"]])
+    )
+    date_codes = fold_dates.get_indexer(test_rows["date"])
+    lag_cols = [f"sales_lag{lag}" for lag in lags]
+    fold_features.loc[test_mask, "sales"] = block[series_codes, date_codes]
+    fold_features.loc[test_mask, lag_cols] = ut.lagged_features_block(
+        block, lags, series_codes, date_codes
+    )
+    fold_features.loc[test_mask, "sales_mean"] = ut.moving_averages_block(
+        block, min(lags), series_codes, date_codes, window_size
     )
+
+    if check_leakage:
+        check_fold_leakage(
+            fold_features,
+            train_df,
+            lags,
+            window_size,
+            used_columns,
+            first_date,
+            gap,
+            horizon,
+            compact,
+        )
+    return fold_features, train_end_date
+
+
+def prepare_fold_data(
+    data_train,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    fold_num,
+    first_date,
+    gap,
+    horizon,
+    data_test,
+    feature_cache=None,
+    fold_features=None,
+    compact=False,
+    memory_report=None,
+    preprocessing="ohe_scale",
+    feature_n_jobs=1,
+    train_end_date=None,
+    cv_audit=False,
+):
+    if fold_features is None:
+        features, train_end_date = create_features(
+            data_train,
+            lags,
+            window_size,
+            used_columns,
+            fold_num,
+            first_date,
+            gap,
+            horizon,
+            data_test,
+            feature_cache,
+            compact,
+            memory_report,
+            feature_n_jobs=feature_n_jobs,
+            train_end_date=train_end_date,
+            cv_audit=cv_audit,
+        )
+    else:
+        features, train_end_date = fold_features
     (
         train_fea,
         test_fea,
@@ -138,12 +475,110 @@ def create_features_train_predict(
         )
 
     X_train, y_train, X_test = mlh.get_xy(train_fea, test_fea, "sales")
-    y_train = mlh.transform_target(y_train)
-    X_train, X_test, cats_enc, non_cats_enc = mlh.preprocess_features(
-        X_train, X_test, categ_fea
-    )
+    with memh.track_stage(
+        "transform_target", memory_report, len(y_train)
+    ) as stage:
+        y_train = mlh.transform_target(y_train)
+        stage["rows_out"] = len(y_train)
+
+    with memh.track_stage(
+        "preprocess_features", memory_report, len(X_train) + len(X_test)
+    ) as stage:
+        # "ohe_scale": one-hot encode categoricals and scale numericals
+        # "tree_native": integer-coded categoricals for LightGBM, no scaling
+        preprocess_func = {
+            "ohe_scale": mlh.preprocess_features,
+            "tree_native": mlh.preprocess_features_tree_native,
+        }[preprocessing]
+        (
+            X_train,
+            X_test,
+            cats_enc,
+            non_cats_enc,
+            fitted_preprocessor,
+        ) = preprocess_func(
+            X_train, X_test, categ_fea, compact, return_preprocessor=True
+        )
+        stage["rows_out"] = len(X_train) + len(X_test)
 
     feature_cols = mlh.get_feature_cols(X_train, cats_enc, non_cats_enc)
+    # Store, item and date of every row of X_test
+    test_keys = test_fea[["store", "item", "date"]].reset_index(drop=True)
+    return [
+        X_train,
+        y_train,
+        X_test,
+        feature_cols,
+        train_end_date,
+        test_start_date_manual,
+        test_end_date_manual,
+        fitted_preprocessor,
+        test_keys,
+    ]
+
+
+def create_features_train_predict(
+    data_train,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    fold_num,
+    first_date,
+    gap,
+    horizon,
+    data_test,
+    model_params,
+    model_fit_params,
+    scoring_func,
+    feature_cache=None,
+    fold_features=None,
+    compact=False,
+    memory_report=None,
+    preprocessing="ohe_scale",
+    dataset_manager=None,
+    feature_n_jobs=1,
+    return_fold_info=False,
+    train_end_date=None,
+    cv_audit=False,
+):
+    """Build the fold features, train the model and predict the test rows.
+
+    With return_fold_info=True the fitted preprocessor and the store, item
+    and date of every X_test row are appended to the returned items.
+    train_end_date defaults to the last date of data_train; pass the one of
+    all series when data_train only holds some of them.
+    """
+    (
+        X_train,
+        y_train,
+        X_test,
+        feature_cols,
+        train_end_date,
+        test_start_date_manual,
+        test_end_date_manual,
+        fitted_preprocessor,
+        test_keys,
+    ) = prepare_fold_data(
+        data_train,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        fold_num,
+        first_date,
+        gap,
+        horizon,
+        data_test,
+        feature_cache,
+        fold_features,
+        compact,
+        memory_report,
+        preprocessing,
+        feature_n_jobs,
+        train_end_date,
+        cv_audit,
+    )
 
     # Use model_train_predict_sklearn() or model_train_predict()
     y_pred_test, model = mlth.model_train_predict(
@@ -154,8 +589,11 @@ def create_features_train_predict(
         model_params,
         model_fit_params,
         scoring_func,
+        categ_fea if preprocessing == "tree_native" else "auto",
+        dataset_manager,
+        memory_report,
     )
-    return [
+    results = [
         X_test,
         y_pred_test,
         model,
@@ -163,6 +601,197 @@ def create_features_train_predict(
         test_start_date_manual,
         test_end_date_manual,
     ]
+    if return_fold_info:
+        results += [fitted_preprocessor, test_keys]
+    return results
+
+
+def get_thread_budget(n_jobs, num_tasks, cpu_count=None):
+    """Split the available cores between concurrent CV folds and LightGBM.
+
+    Returns the number of worker processes and the LightGBM nthread value
+    per worker, so that workers x nthread does not exceed the core count.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if n_jobs < 0:
+        n_jobs = cpu_count
+    n_workers = max(1, min(n_jobs, num_tasks, cpu_count))
+    nthread = max(1, cpu_count // n_workers)
+    return n_workers, nthread
+
+
+def score_fold(
+    r,
+    train_df,
+    test_df,
+    num_splits,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params,
+    scoring_func,
+    model_fit_params,
+    feature_cache=None,
+    fold_features=None,
+    nthread=None,
+    compact=False,
+    memory_report=None,
+    preprocessing="ohe_scale",
+    dataset_manager=None,
+    return_predictions=False,
+    feature_n_jobs=1,
+    cv_audit=False,
+):
+    print("---------- Round " + str(r + 1) + " ----------")
+    # Each fold records its stages in its own list, returned with the
+    # record, since folds may run in other processes
+    fold_report = None if memory_report is None else []
+    train_model_params = model_params
+    if nthread is not None:
+        train_model_params = dict(model_params, nthread=nthread)
+    (
+        X_test,
+        y_pred_test,
+        _,
+        train_cv_fold_end_date,
+        test_cv_fold_start_date,
+        test_cv_fold_end_date,
+        _,
+        test_keys,
+    ) = create_features_train_predict(
+        train_df,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        r + 1,
+        first_date,
+        gap,
+        horizon,
+        test_df,
+        train_model_params,
+        model_fit_params,
+        scoring_func,
+        feature_cache,
+        fold_features,
+        compact,
+        fold_report,
+        preprocessing,
+        dataset_manager,
+        feature_n_jobs,
+        return_fold_info=True,
+        cv_audit=cv_audit,
+    )
+    with memh.track_stage("score", fold_report, len(test_df)):
+        # Predictions are matched to test_df rows by store, item and date,
+        # not by row order
+        y_pred_test = np.expm1(
+            mlh.align_to_keys(y_pred_test, test_keys, test_df.reset_index())
+        )
+        smape_score_test = smape(y_pred_test, test_df["sales"].to_numpy())
+    print("SMAPE of the predictions is {}".format(smape_score_test))
+    summary_dict = {
+        "fold": r + 1,
+        "model_params": model_params,
+        "model_params_str": str(model_params),
+        "train_end_date": train_cv_fold_end_date,
+        "test_start_date": test_cv_fold_start_date,
+        "test_end_date": test_cv_fold_end_date,
+        "smape": smape_score_test,
+    }
+    telemetry = get_telemetry_records(model_fit_params)
+    if telemetry is not None:
+        summary_dict["telemetry"] = telemetry
+    if num_splits == 1 or return_predictions:
+        y_pred_test = pd.Series(y_pred_test, index=test_df.index)
+        summary_dict["y_pred"] = y_pred_test
+    if num_splits == 1:
+        summary_dict["X_test"] = X_test
+    if fold_report is not None:
+        summary_dict["memory_report"] = fold_report
+    return summary_dict
+
+
+def get_cv_folds(
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    first_date,
+    gap,
+    horizon,
+    feature_cache=None,
+    features_once=False,
+    compact=False,
+    memory_report=None,
+    feature_n_jobs=1,
+    check_leakage=False,
+    cv_audit=False,
+):
+    """Yield [fold number, train frame, test frame, fold features] for every
+    CV fold, one fold at a time; fold features are None unless
+    features_once is set.
+    features_once only supports expanding-window folds, whose training rows
+    are a prefix of the full history, and raises ValueError on a fold that
+    starts later (sliding windows). check_leakage checks the fold features
+    of features_once against the per-fold path (see get_fold_features()).
+    cv_audit is the full_audit of show_cv_dates()."""
+    full_features = None
+    if features_once:
+        data_start_date = data.index.get_level_values(1).min()
+    for r, (train_idx, test_idx) in enumerate(cv.split(X=data)):
+        train_df = data.iloc[train_idx]
+        test_df = data.iloc[test_idx]
+
+        fold_features = None
+        if features_once:
+            train_start_date = train_df.index.get_level_values(1).min()
+            if train_start_date > data_start_date:
+                raise ValueError(
+                    f"features_once needs expanding-window folds, but fold "
+                    f"{r + 1} starts on {train_start_date.date()}; use "
+                    "features_once=False for sliding windows"
+                )
+            if full_features is None:
+                # Build features over the full history once, then slice
+                # every fold
+                full_features, _ = create_features(
+                    data,
+                    lags,
+                    window_size,
+                    used_columns,
+                    0,
+                    first_date,
+                    gap,
+                    horizon,
+                    pd.DataFrame(),
+                    feature_cache,
+                    compact,
+                    memory_report,
+                    feature_n_jobs=feature_n_jobs,
+                )
+            start_time = time()
+            fold_features = get_fold_features(
+                full_features,
+                train_df,
+                lags,
+                window_size,
+                first_date,
+                gap,
+                horizon,
+                used_columns,
+                compact,
+                check_leakage,
+            )
+            show_cv_dates(
+                r + 1, train_df, test_df, time() - start_time, gap, cv_audit
+            )
+        yield [r, train_df, test_df, fold_features]
 
 
 def score_model(
@@ -178,53 +807,124 @@ def score_model(
     model_params,
     scoring_func,
     model_fit_params={"early_stoppin_rounds": 200, "verbose": 0},
+    feature_cache=None,
+    features_once=False,
+    n_jobs=1,
+    compact=False,
+    memory_report=None,
+    preprocessing="ohe_scale",
+    dataset_manager=None,
+    return_predictions=False,
+    report_path=None,
+    feature_n_jobs=1,
+    check_leakage=False,
+    cv_audit=False,
 ):
-    num_splits = cv.get_n_splits(X=data.iloc[:2], y=data.iloc[2])
-    scoring_records_summary = []
-    for r, (train_idx, test_idx) in enumerate(cv.split(X=data)):
-        train_df = data.iloc[train_idx]
-        test_df = data.iloc[test_idx]
+    """Score model_params with cross-validation, one record per fold.
 
-        print("---------- Round " + str(r + 1) + " ----------")
+    If memory_report is a list, the stage records (wall and CPU time, peak
+    memory, row counts) of every fold are appended to it, tagged with the
+    fold number. If report_path is given they are also written there as
+    JSON lines. feature_n_jobs != 1 builds features with
+    build_features_parallel(); with n_jobs != 1 every fold worker gets at
+    most its share of the cores for it. check_leakage checks the fold
+    features of features_once against features built per fold. cv_audit
+    checks every fold for train and test rows that are duplicated, on top
+    of the cheap date checks (see show_cv_dates()).
+    """
+    if report_path is not None and memory_report is None:
+        memory_report = []
+    num_splits = cv.get_n_splits(X=data.iloc[:2], y=data.iloc[2])
+    fold_args = get_cv_folds(
+        data,
+        cv,
+        lags,
+        window_size,
+        used_columns,
+        first_date,
+        gap,
+        horizon,
+        feature_cache,
+        features_once,
+        compact,
+        memory_report,
+        feature_n_jobs,
+        check_leakage,
+        cv_audit,
+    )
+    fold_kwargs = dict(
+        compact=compact,
+        preprocessing=preprocessing,
+        dataset_manager=dataset_manager,
+        return_predictions=return_predictions,
+        feature_n_jobs=feature_n_jobs,
+        cv_audit=cv_audit,
+    )
 
-        (
-            X_test,
-            y_pred_test,
-            _,
-            train_cv_fold_end_date,
-            test_cv_fold_start_date,
-            test_cv_fold_end_date,
-        ) = create_features_train_predict(
-            train_df,
-            lags,
-            window_size,
-            used_columns,
-            categ_fea,
-            r + 1,
-            first_date,
-            gap,
-            horizon,
-            test_df,
-            model_params,
-            model_fit_params,
-            scoring_func,
-        )
-        smape_score_test = smape(
-            np.expm1(y_pred_test), test_df["sales"].to_numpy()
+    common_args = [
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        first_date,
+        gap,
+        horizon,
+        model_params,
+        scoring_func,
+        model_fit_params,
+        feature_cache,
+    ]
+    if n_jobs == 1:
+        scoring_records_summary = [
+            score_fold(
+                r,
+                train_df,
+                test_df,
+                num_splits,
+                *common_args,
+                ff,
+                memory_report=memory_report,
+                **fold_kwargs,
+            )
+            for r, train_df, test_df, ff in fold_args
+        ]
+    else:
+        n_workers, nthread = get_thread_budget(n_jobs, num_splits)
+        # Fold workers split the cores for their feature pools as for
+        # LightGBM, instead of each starting feature_n_jobs processes
+        fold_kwargs["feature_n_jobs"] = (
+            nthread if feature_n_jobs < 0 else min(feature_n_jobs, nthread)
         )
-        print("SMAPE of the predictions is {}".format(smape_score_test))
-        summary_dict = {
-            "fold": r + 1,
-            "model_params": model_params,
-            "model_params_str": str(model_params),
-            "train_end_date": train_cv_fold_end_date,
-            "test_start_date": test_cv_fold_start_date,
-            "test_end_date": test_cv_fold_end_date,
-            "smape": smape_score_test,
-        }
-        if num_splits == 1:
-            test_index = test_df.index
-            y_pred_test = pd.Series(np.expm1(y_pred_test), index=test_index)
-            summary_dict.update({"y_pred": y_pred_test, "X_test": X_test})
-        scoring_records_summary.append(summary_dict)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = []
+            for r, train_df, test_df, ff in fold_args:
+                # Only folds of running tasks are held in memory
+                running = [f for f in futures if not f.done()]
+                if len(running) >= n_workers:
+                    wait(running, return_when=FIRST_COMPLETED)
+                futures.append(
+                    executor.submit(
+                        score_fold,
+                        r,
+                        train_df,
+                        test_df,
+                        num_splits,
+                        *common_args,
+                        ff,
+                        nthread,
+                        memory_report=memory_report,
+                        **fold_kwargs,
+                    )
+                )
+                del train_df, test_df, ff
+            # Gather in fold order, whichever fold finishes first
+            scoring_records_summary = [f.result() for f in futures]
+    if memory_report is not None:
+        for summary_dict in scoring_records_summary:
+            memory_report.extend(
+                dict(record, fold=summary_dict["fold"])
+                for record in summary_dict.pop("memory_report")
+            )
+    if report_path is not None:
+        memh.write_stage_report(memory_report, report_path)
     return scoring_records_summary
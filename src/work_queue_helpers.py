@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+import socket
+import threading
+import traceback
+from multiprocessing import Process
+from tempfile import NamedTemporaryFile
+from time import sleep, time
+from uuid import uuid4
+
+import joblib
+import pandas as pd
+
+from src.feature_cache import FeatureCache
+from src.utils import get_thread_budget, score_fold
+
+QUEUE_STATES = ["pending", "claimed", "done", "failed"]
+
+
+def init_queue(queue_dir):
+    for state in QUEUE_STATES + ["data"]:
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+
+def atomic_dump(obj, path):
+    "Helper function that writes obj so that readers never see part of it."
+    with NamedTemporaryFile(
+        dir=os.path.dirname(path), suffix=".tmp", delete=False
+    ) as f:
+        joblib.dump(obj, f)
+    os.replace(f.name, path)
+
+
+def get_share_time(queue_dir):
+    """Current time of the file system holding queue_dir, read from the
+    mtime of a touched probe file. Heartbeats are file mtimes on the same
+    file system, so comparing them with this time is not affected by clock
+    skew between the coordinator, the workers and the file server."""
+    probe_path = os.path.join(queue_dir, "clock")
+    with open(probe_path, "a"):
+        pass
+    os.utime(probe_path)
+    return os.path.getmtime(probe_path)
+
+
+def submit_score_model_units(
+    queue_dir,
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params_all,
+    scoring_func,
+    model_fit_params,
+    compact=False,
+    preprocessing="ohe_scale",
+    return_predictions=False,
+):
+    """Write one work unit per (model_params, CV fold) to the queue.
+
+    data is written to the queue once per submission; a unit refers to it
+    by its path relative to queue_dir, which may be mounted elsewhere on
+    the workers, and to its fold by the row positions of the training and
+    test rows, along with the feature config and model params that
+    score_fold() needs. Returns the ids of the units, in (model_params,
+    fold) order; remove the submission with cleanup_run().
+    """
+    init_queue(queue_dir)
+    # Unit ids are unique per submission, so that results of earlier runs
+    # left in queue_dir are never collected
+    run_id = uuid4().hex[:12]
+    data_path = os.path.join("data", f"{run_id}.joblib")
+    atomic_dump(data, os.path.join(queue_dir, data_path))
+    folds = list(cv.split(X=data))
+    unit_ids = []
+    for k, model_params in enumerate(model_params_all):
+        for r, (train_idx, test_idx) in enumerate(folds):
+            unit_id = f"{run_id}-{k:04d}-{r:03d}"
+            unit = {
+                "unit_id": unit_id,
+                "attempts": 0,
+                "data_path": data_path,
+                "train_idx": train_idx,
+                "test_idx": test_idx,
+                "fold_args": [
+                    r,
+                    len(folds),
+                    lags,
+                    window_size,
+                    used_columns,
+                    categ_fea,
+                    first_date,
+                    gap,
+                    horizon,
+                    model_params,
+                    scoring_func,
+                    model_fit_params,
+                ],
+                "fold_kwargs": dict(
+                    compact=compact,
+                    preprocessing=preprocessing,
+                    return_predictions=return_predictions,
+                ),
+            }
+            atomic_dump(
+                unit, os.path.join(queue_dir, "pending", f"{unit_id}.joblib")
+            )
+            unit_ids.append(unit_id)
+    return unit_ids
+
+
+def claim_unit(queue_dir, worker_id):
+    """Move the first pending unit to claimed/. The rename is atomic, so a
+    unit is claimed by at most one worker. Returns the claimed path or
+    None if no unit is pending."""
+    for file_name in sorted(os.listdir(os.path.join(queue_dir, "pending"))):
+        if not file_name.endswith(".joblib"):
+            continue
+        unit_id = file_name[: -len(".joblib")]
+        claimed_path = os.path.join(
+            queue_dir, "claimed", f"{unit_id}.{worker_id}.joblib"
+        )
+        try:
+            os.rename(
+                os.path.join(queue_dir, "pending", file_name), claimed_path
+            )
+        except FileNotFoundError:
+            # Claimed by another worker first
+            continue
+        # The first heartbeat; the rename keeps the time of submission
+        os.utime(claimed_path)
+        return claimed_path
+    return None
+
+
+def keep_alive(path, stop_event, interval):
+    "Helper function that touches path until stop_event is set."
+    while not stop_event.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def run_worker(
+    queue_dir,
+    worker_id=None,
+    nthread=None,
+    feature_cache_dir=None,
+    heartbeat_interval=10,
+    poll_interval=1,
+    idle_timeout=None,
+):
+    """Pull work units from the queue, score them with score_fold() and
+    write the summary records to done/.
+
+    A unit's claimed file is touched every heartbeat_interval seconds while
+    it runs, so the coordinator can tell live workers from dead ones. A unit
+    that raises is written to failed/ with its traceback, for the
+    coordinator to retry. A result is dropped if the coordinator requeued
+    or removed the unit in the meantime. The worker stops after
+    idle_timeout seconds without pending units (never if None).
+    """
+    init_queue(queue_dir)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    feature_cache = None
+    if feature_cache_dir is not None:
+        feature_cache = FeatureCache(feature_cache_dir)
+    # Only the data of the current submission is kept in memory
+    data_path, data = None, None
+    idle_since = time()
+    while True:
+        claimed_path = claim_unit(queue_dir, worker_id)
+        if claimed_path is None:
+            if idle_timeout is not None and time() - idle_since > idle_timeout:
+                return
+            sleep(poll_interval)
+            continue
+        unit = joblib.load(claimed_path)
+        print(f"Worker {worker_id}: unit {unit['unit_id']}")
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(
+            target=keep_alive,
+            args=(claimed_path, stop_event, heartbeat_interval),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            if unit["data_path"] != data_path:
+                data_path, data = None, None
+                data = joblib.load(os.path.join(queue_dir, unit["data_path"]))
+                data_path = unit["data_path"]
+            r, num_splits, *fold_args = unit["fold_args"]
+            record = score_fold(
+                r,
+                data.iloc[unit["train_idx"]],
+                data.iloc[unit["test_idx"]],
+                num_splits,
+                *fold_args,
+                feature_cache,
+                nthread=nthread,
+                **unit["fold_kwargs"],
+            )
+            state, result = "done", record
+        except Exception:
+            state, result = "failed", traceback.format_exc()
+        finally:
+            stop_event.set()
+            heartbeat.join()
+        idle_since = time()
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            # Requeued or removed by the coordinator in the meantime
+            continue
+        atomic_dump(
+            {
+                "unit_id": unit["unit_id"],
+                "worker_id": worker_id,
+                state: result,
+                "unit": unit,
+            },
+            os.path.join(queue_dir, state, f"{unit['unit_id']}.joblib"),
+        )
+
+
+def requeue_unit(queue_dir, unit, max_attempts, error="worker died"):
+    """Helper function that puts the unit of a dead worker, or of a worker
+    where it raised, back in pending/."""
+    unit["attempts"] += 1
+    if unit["attempts"] >= max_attempts:
+        raise RuntimeError(
+            f"Unit {unit['unit_id']} failed {unit['attempts']} times, "
+            f"last: {error}"
+        )
+    atomic_dump(
+        unit, os.path.join(queue_dir, "pending", f"{unit['unit_id']}.joblib")
+    )
+    print(f"Requeued unit {unit['unit_id']} (attempt {unit['attempts']})")
+
+
+def cleanup_run(queue_dir, unit_ids):
+    """Remove the data and the units of a submission from every state
+    directory of the queue. Workers drop the results of removed units they
+    are still running."""
+    run_ids = {unit_id.split("-")[0] for unit_id in unit_ids}
+    for state in QUEUE_STATES + ["data"]:
+        state_dir = os.path.join(queue_dir, state)
+        for file_name in os.listdir(state_dir):
+            if file_name.split(".")[0].split("-")[0] in run_ids:
+                try:
+                    os.remove(os.path.join(state_dir, file_name))
+                except FileNotFoundError:
+                    pass
+
+
+def collect_results(
+    queue_dir,
+    unit_ids,
+    heartbeat_timeout=60,
+    max_attempts=3,
+    poll_interval=1,
+    timeout=None,
+    poll_callback=None,
+):
+    """Wait for the records of unit_ids and return them in unit_ids order.
+
+    Units whose worker has not touched them for heartbeat_timeout seconds,
+    by the clock of the shared file system, and units that raised in a
+    worker are requeued. A unit that fails max_attempts times makes this
+    raise with the last worker's traceback. Collected records are removed
+    from done/. poll_callback, if given, is called on every poll, e.g. to
+    restart dead local workers.
+    """
+    pending_ids = set(unit_ids)
+    records = {}
+    start_time = time()
+    while pending_ids:
+        for unit_id in list(pending_ids):
+            failed_path = os.path.join(
+                queue_dir, "failed", f"{unit_id}.joblib"
+            )
+            if os.path.exists(failed_path):
+                failed = joblib.load(failed_path)
+                requeue_unit(
+                    queue_dir,
+                    failed["unit"],
+                    max_attempts,
+                    f"on worker {failed['worker_id']}:\n{failed['failed']}",
+                )
+                os.remove(failed_path)
+            done_path = os.path.join(queue_dir, "done", f"{unit_id}.joblib")
+            if os.path.exists(done_path):
+                records[unit_id] = joblib.load(done_path)["done"]
+                os.remove(done_path)
+                pending_ids.remove(unit_id)
+        share_time = get_share_time(queue_dir)
+        for file_name in os.listdir(os.path.join(queue_dir, "claimed")):
+            claimed_path = os.path.join(queue_dir, "claimed", file_name)
+            unit_id = file_name.split(".")[0]
+            if unit_id not in pending_ids:
+                continue
+            try:
+                last_beat = os.path.getmtime(claimed_path)
+                if share_time - last_beat <= heartbeat_timeout:
+                    continue
+                unit = joblib.load(claimed_path)
+                os.remove(claimed_path)
+            except FileNotFoundError:
+                # Finished or requeued in the meantime
+                continue
+            requeue_unit(queue_dir, unit, max_attempts)
+        if poll_callback is not None:
+            poll_callback()
+        if timeout is not None and time() - start_time > timeout:
+            raise TimeoutError(f"{len(pending_ids)} units not done")
+        if pending_ids:
+            sleep(poll_interval)
+    return [records[unit_id] for unit_id in unit_ids]
+
+
+def start_local_worker(queue_dir, worker_id, nthread):
+    "Helper function that starts run_worker() in a local process."
+    worker = Process(target=run_worker, args=(queue_dir, worker_id, nthread))
+    worker.start()
+    return worker
+
+
+def score_model_distributed(
+    queue_dir,
+    data,
+    cv,
+    lags,
+    window_size,
+    used_columns,
+    categ_fea,
+    first_date,
+    gap,
+    horizon,
+    model_params_all,
+    scoring_func,
+    model_fit_params,
+    compact=False,
+    preprocessing="ohe_scale",
+    return_predictions=False,
+    n_local_workers=0,
+    heartbeat_timeout=60,
+    max_attempts=3,
+    timeout=None,
+):
+    """Score every params dict in model_params_all on every CV fold through
+    the work queue in queue_dir, a directory shared with the workers.
+
+    Start workers on other hosts with run_worker(queue_dir), or set
+    n_local_workers to run that many local worker processes. Local workers
+    run until all records are in, and dead ones are restarted so that
+    requeued units are picked up. timeout (seconds, never if None) bounds
+    the wait for the records. Returns the
+    score_fold() records of all units, as a DataFrame in the format of
+    score_model() records for get_best_model_hyper_params(). The data and
+    units of the submission are removed from the queue afterwards.
+    Usage
+    -----
+    > # on every worker host
+    > python3 -c "from src.work_queue_helpers import run_worker; \\
+          run_worker('/mnt/shared/queue')"
+    > # on the coordinator
+    > df_cv = score_model_distributed("/mnt/shared/queue", data, cv, ...)
+    """
+    unit_ids = submit_score_model_units(
+        queue_dir,
+        data,
+        cv,
+        lags,
+        window_size,
+        used_columns,
+        categ_fea,
+        first_date,
+        gap,
+        horizon,
+        model_params_all,
+        scoring_func,
+        model_fit_params,
+        compact,
+        preprocessing,
+        return_predictions,
+    )
+    _, nthread = get_thread_budget(n_local_workers or 1, len(unit_ids))
+    worker_prefix = f"local-{os.getpid()}"
+    workers = [
+        start_local_worker(queue_dir, f"{worker_prefix}-{i}", nthread)
+        for i in range(n_local_workers)
+    ]
+    n_started = n_local_workers
+
+    def restart_dead_workers():
+        # Replacements get fresh ids, the requeued units are claimed anew
+        nonlocal n_started
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                workers[i] = start_local_worker(
+                    queue_dir, f"{worker_prefix}-{n_started}", nthread
+                )
+                n_started += 1
+
+    try:
+        records = collect_results(
+            queue_dir,
+            unit_ids,
+            heartbeat_timeout,
+            max_attempts,
+            timeout=timeout,
+            poll_callback=restart_dead_workers,
+        )
+    finally:
+        cleanup_run(queue_dir, unit_ids)
+        # The workers have no idle timeout, all units are done or abandoned
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+    return pd.DataFrame.from_records(records)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.feature_utils as ut
+from src.synthetic_data_helpers import make_synthetic_sales
+
+
+@pytest.fixture(scope="session")
+def sales():
+    "Small synthetic sales data, indexed by (symbol, date)."
+    return make_synthetic_sales(n_stores=2, n_items=3, n_days=400, seed=0)
+
+
+@pytest.fixture(scope="session")
+def sales_grid(sales):
+    """Complete store x item x date grid of the sales, with about 10% of the
+    days missing and 60 future dates without sales."""
+    rng = np.random.default_rng(1)
+    train = sales.reset_index().drop(columns="symbol")
+    train = train[rng.random(len(train)) > 0.1]
+    dates = pd.date_range(
+        train["date"].min(), train["date"].max() + pd.DateOffset(days=60)
+    )
+    _, series = ut.get_series_codes(train, ["store", "item"])
+    grid = ut.df_from_series_product(series, dates)
+    return pd.merge(grid, train, how="left", on=["store", "item", "date"])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+
+import numpy as np
+
+from benchmark_runner import (
+    baseline_path,
+    compare_to_baseline,
+    default_sizes,
+    summarize_stages,
+)
+
+
+def test_summarize_stages_adds_up_folds():
+    summary = summarize_stages(
+        [
+            {
+                "stage": "a",
+                "wall_s": 1.0,
+                "cpu_s": 0.5,
+                "peak_mb": 10.0,
+                "rows_in": 5,
+            },
+            {
+                "stage": "b",
+                "wall_s": 2.0,
+                "cpu_s": 1.0,
+                "peak_mb": 1.0,
+                "rows_in": 7,
+            },
+            {
+                "stage": "a",
+                "wall_s": 3.0,
+                "cpu_s": 1.5,
+                "peak_mb": 20.0,
+                "rows_in": 5,
+            },
+        ]
+    )
+    assert list(summary) == ["a", "b"]
+    assert summary["a"] == {
+        "wall_s": 4.0,
+        "cpu_s": 2.0,
+        "peak_mb": 20.0,
+        "rows_in": 10,
+    }
+
+
+def test_compare_to_baseline_flags_regressions():
+    results = {
+        "1x1x10": {
+            "stages": {
+                "fast": {"wall_s": 1.0},
+                "slow": {"wall_s": 3.0, "peak_mb": 5.0},
+                "new": {"wall_s": 1.0},
+            }
+        }
+    }
+    baseline = {
+        "1x1x10": {
+            "stages": {"fast": {"wall_s": 1.0}, "slow": {"wall_s": 2.0}}
+        }
+    }
+    df = compare_to_baseline(results, baseline, tolerance=1.25).set_index(
+        "stage"
+    )
+    assert df["regression"].to_dict() == {
+        "fast": False,
+        "slow": True,
+        "new": False,
+    }
+    assert df.loc["slow", "ratio"] == 1.5
+    assert np.isnan(df.loc["new", "baseline_wall_s"])
+    assert np.isnan(df.loc["fast", "peak_mb"])
+
+
+def test_committed_baseline_covers_stages():
+    assert os.path.exists(baseline_path)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    assert set(baseline) <= set(default_sizes)
+    for result in baseline.values():
+        assert result["rows"] > 0
+        assert "generate" in result["stages"]
+        assert any(stage.startswith("cv_") for stage in result["stages"])
+        assert any(stage.startswith("pred_") for stage in result["stages"])
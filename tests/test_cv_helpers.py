@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cv_helpers import MultiTimeSeriesDateSplit, show_cv_dates
+
+
+def split_by_masks(cv, X):
+    "Date mask folds, as generated before integer date codes."
+    periods = sorted(X.index.get_level_values("date").unique(), reverse=True)
+    df_dates = X.reset_index()[["date"]]
+    for fold_num in range(cv.num_folds):
+        test_end_idx = fold_num * cv.forecast_horizon
+        test_start_idx = test_end_idx + cv.forecast_horizon
+        train_end_idx = test_start_idx + cv.lookahead_len - 1
+        train_mask = df_dates["date"] <= periods[train_end_idx]
+        if cv.train_length:
+            train_start_idx = (
+                train_end_idx + cv.train_length + cv.lookahead_len - 1
+            )
+            train_mask &= df_dates["date"] > periods[train_start_idx]
+        test_mask = (df_dates["date"] > periods[test_start_idx]) & (
+            df_dates["date"] <= periods[test_end_idx]
+        )
+        yield df_dates[train_mask].index, df_dates[test_mask].index
+
+
+@pytest.mark.parametrize("order", ["series", "date", "shuffled"])
+@pytest.mark.parametrize(
+    "cv_kwargs",
+    [
+        dict(num_folds=2, forecast_horizon=30, look_ahead_length=30),
+        dict(
+            num_folds=2,
+            train_period_length=120,
+            forecast_horizon=30,
+            look_ahead_length=30,
+        ),
+        dict(num_folds=3, forecast_horizon=14),
+    ],
+)
+def test_split_matches_date_masks(sales, order, cv_kwargs):
+    if order == "date":
+        sales = sales.sort_index(level="date", sort_remaining=False)
+    elif order == "shuffled":
+        sales = sales.sample(frac=1, random_state=0)
+    cv = MultiTimeSeriesDateSplit(**cv_kwargs)
+    folds = list(cv.split(sales))
+    expected = list(split_by_masks(cv, sales))
+    assert len(folds) == len(expected)
+    for (train_idx, test_idx), (exp_train, exp_test) in zip(folds, expected):
+        np.testing.assert_array_equal(train_idx, exp_train.to_numpy())
+        np.testing.assert_array_equal(test_idx, exp_test.to_numpy())
+
+
+def test_show_cv_dates_checks_gap_and_duplicates(sales):
+    cv = MultiTimeSeriesDateSplit(
+        num_folds=1, forecast_horizon=30, look_ahead_length=11
+    )
+    train_idx, test_idx = next(cv.split(sales))
+    train_df, test_df = sales.iloc[train_idx], sales.iloc[test_idx]
+    show_cv_dates(1, train_df, test_df, 0, gap=10, full_audit=True)
+    test_dates = test_df.index.get_level_values("date")
+    with pytest.raises(AssertionError, match="11-day gap"):
+        show_cv_dates(
+            1, train_df, test_df[test_dates > test_dates.min()], 0, gap=10
+        )
+    # A duplicated test row is only found by the full audit
+    duplicated = pd.concat([test_df, test_df.iloc[:1]])
+    show_cv_dates(1, train_df, duplicated, 0, gap=10)
+    with pytest.raises(AssertionError):
+        show_cv_dates(1, train_df, duplicated, 0, gap=10, full_audit=True)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+
+import src.eng_features_helpers as fh
+
+
+def test_add_datepart_matches_per_row_columns(monkeypatch):
+    monkeypatch.setattr(fh, "_DATEPART_TABLE", None)
+    dates = pd.Series(
+        np.random.default_rng(0).choice(
+            pd.date_range("2015-01-01", "2016-12-31"), 300
+        )
+    )
+    dates[5] = pd.NaT
+    df = fh.add_datepart(pd.DataFrame({"date": dates}), "date", drop=False)
+    expected = fh.calc_datepart_table(dates.dropna())
+    np.testing.assert_array_equal(
+        df.drop(columns="date").dropna().to_numpy(), expected.to_numpy()
+    )
+    assert df.drop(columns="date").iloc[5].isna().all()
+
+
+def test_datepart_table_is_shared_and_extended(monkeypatch):
+    monkeypatch.setattr(fh, "_DATEPART_TABLE", None)
+    fold = pd.DataFrame({"date": pd.date_range("2015-01-01", "2015-12-31")})
+    fh.add_datepart(fold.copy(), "date")
+    table = fh._DATEPART_TABLE
+    # An earlier fold reuses the table
+    fh.add_datepart(fold.iloc[:100].copy(), "date")
+    assert fh._DATEPART_TABLE is table
+    # Forecast dates after the range extend it
+    future = pd.DataFrame({"date": pd.date_range("2016-03-01", periods=10)})
+    fh.add_datepart(future, "date")
+    assert fh._DATEPART_TABLE.index[0] == table.index[0]
+    assert fh._DATEPART_TABLE.index[-1] == pd.Timestamp("2016-03-10")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+import threading
+from multiprocessing import Process
+
+import numpy as np
+import pandas as pd
+
+from src.feature_cache import FeatureCache
+
+
+def make_frame(n_rows=100, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {"store": np.arange(n_rows) % 3, "sales": rng.random(n_rows)}
+    )
+
+
+def put_frame(cache_dir, key, seed):
+    "Helper function that writes one entry from another process."
+    FeatureCache(cache_dir).put(key, make_frame(seed=seed))
+
+
+def test_get_or_create_round_trip(tmp_path):
+    cache = FeatureCache(tmp_path)
+    df = make_frame()
+    key = cache.make_key(df, lags=[1, 2], window_size=7)
+    calls = []
+
+    def create():
+        calls.append(1)
+        return df * 2
+
+    first = cache.get_or_create(key, create)
+    second = cache.get_or_create(key, create)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert cache.get("missing") is None
+    cache.clear()
+    assert cache.get(key) is None
+
+
+def test_fingerprint_invalidation(tmp_path):
+    cache = FeatureCache(tmp_path)
+    df = make_frame()
+    key = cache.make_key(df, lags=np.arange(3), window_size=7)
+    assert key == cache.make_key(df.copy(), lags=[0, 1, 2], window_size=7)
+    changed = df.copy()
+    changed.loc[5, "sales"] += 1
+    assert key != cache.make_key(changed, lags=[0, 1, 2], window_size=7)
+    assert key != cache.make_key(
+        df.astype({"store": "int32"}), lags=[0, 1, 2], window_size=7
+    )
+    assert key != cache.make_key(
+        df.set_axis(df.index + 1, axis=0), lags=[0, 1, 2], window_size=7
+    )
+    assert key != cache.make_key(df, lags=[0, 1, 2], window_size=14)
+
+
+def test_lru_eviction(tmp_path):
+    cache = FeatureCache(tmp_path)
+    for n, key in enumerate(["a", "b"]):
+        cache.put(key, make_frame(seed=n))
+        # Entries written in the same second still get distinct times
+        os.utime(cache._path(key), (n, n))
+    entry_size = os.path.getsize(cache._path("a"))
+    cache.max_size_bytes = 2.5 * entry_size
+    cache.get("a")
+    cache.put("c", make_frame(seed=2))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_concurrent_writers(tmp_path):
+    writers = [
+        Process(target=put_frame, args=(tmp_path, "same", seed))
+        for seed in range(4)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    # No temporary files are left behind
+    assert sorted(os.listdir(tmp_path)) == [".lock", "same.parquet"]
+    df = FeatureCache(tmp_path).get("same")
+    assert any(df.equals(make_frame(seed=seed)) for seed in range(4))
+
+
+def test_writer_lock_blocks_readers(tmp_path):
+    cache = FeatureCache(tmp_path)
+    cache.put("a", make_frame())
+    results = []
+    reader = threading.Thread(target=lambda: results.append(cache.get("a")))
+    with cache._lock(exclusive=True):
+        reader.start()
+        reader.join(timeout=0.5)
+        assert reader.is_alive()
+    reader.join(timeout=10)
+    assert not reader.is_alive()
+    pd.testing.assert_frame_equal(results[0], make_frame())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.feature_utils as ut
+
+
+def fill_per_series(df):
+    "Per-series gap filling, as done before fill_series_gaps()."
+    return df.groupby(["store", "item"], group_keys=False).apply(
+        lambda x: x.ffill().bfill()
+    )
+
+
+def test_fill_series_gaps_matches_per_series_fill(sales_grid):
+    filled, _ = ut.fill_series_gaps(sales_grid, ["sales"])
+    pd.testing.assert_frame_equal(filled, fill_per_series(sales_grid))
+
+
+def test_fill_series_gaps_counts_imputed_dates(sales_grid):
+    train_end_date = sales_grid["date"].max() - pd.DateOffset(days=60)
+    _, imputed = ut.fill_series_gaps(
+        sales_grid, ["sales"], count_until=train_end_date
+    )
+    expected = (
+        sales_grid[sales_grid["date"] <= train_end_date]
+        .groupby(["store", "item"], sort=False)["sales"]
+        .apply(lambda x: x.isna().sum())
+    )
+    np.testing.assert_array_equal(imputed["sales"], expected.to_numpy())
+
+
+def test_fill_series_gaps_keeps_float32(sales_grid):
+    grid = sales_grid.astype({"sales": np.float32})
+    filled, _ = ut.fill_series_gaps(grid, ["sales"])
+    assert filled["sales"].dtype == np.float32
+
+
+@pytest.mark.parametrize("window_size", [None, 10])
+def test_combine_features_vectorized_matches_per_series(
+    sales_grid, window_size
+):
+    data_filled = fill_per_series(sales_grid)
+    lags = np.arange(3, 6)
+    expected = data_filled.groupby(["store", "item"], group_keys=False).apply(
+        lambda x: ut.combine_features(
+            x, ["sales"], lags, window_size, list(data_filled)
+        )
+    )
+    features = ut.combine_features_vectorized(
+        data_filled, ["sales"], lags, window_size, list(data_filled)
+    )
+    pd.testing.assert_frame_equal(features, expected.loc[features.index])
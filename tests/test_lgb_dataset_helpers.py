@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+
+from src.lgb_dataset_helpers import LGBDatasetManager, get_binning_params
+
+
+def make_train_set(seed):
+    rng = np.random.default_rng(seed)
+    X_train = pd.DataFrame(rng.random((200, 3)), columns=["a", "b", "c"])
+    return X_train, pd.Series(rng.random(200))
+
+
+def get_dataset(manager, train_set, **model_params):
+    X_train, y_train = train_set
+    return manager.get_train_dataset(
+        X_train, y_train, list(X_train), model_params
+    )
+
+
+def test_binning_aliases():
+    assert get_binning_params(
+        {"max_bins": 63, "min_child_samples": 5, "num_leaves": 8}
+    ) == {"max_bin": 63, "min_data_in_leaf": 5}
+    assert get_binning_params({"max_bin": 63, "max_bins": 31}) == {
+        "max_bin": 63
+    }
+
+
+def test_reuse_and_lru_eviction():
+    manager = LGBDatasetManager(max_datasets=2)
+    train_sets = [make_train_set(seed) for seed in range(3)]
+    first = get_dataset(manager, train_sets[0], num_leaves=8)
+    # Non-binning parameters share the Dataset, binning ones do not
+    assert get_dataset(manager, train_sets[0], num_leaves=16) is first
+    assert get_dataset(manager, train_sets[0], max_bin=63) is not first
+    # Using the first Dataset again makes the max_bin=63 one the oldest
+    get_dataset(manager, train_sets[0])
+    get_dataset(manager, train_sets[1])
+    assert len(manager._datasets) == 2
+    assert get_dataset(manager, train_sets[0]) is first
+    get_dataset(manager, train_sets[2])
+    get_dataset(manager, train_sets[1])
+    assert get_dataset(manager, train_sets[0]) is not first
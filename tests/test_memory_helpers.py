@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import json
+import tracemalloc
+
+import numpy as np
+
+import src.memory_helpers as memh
+
+
+def run_nested_stages(memory_report):
+    "Helper function that allocates 8 MB in an outer, 1 MB in an inner stage."
+    with memh.track_stage("outer", memory_report, 10) as outer:
+        big = np.ones(2**20)
+        del big
+        with memh.track_stage("inner", memory_report) as inner:
+            small = np.ones(2**17)
+            inner["rows_out"] = len(small)
+        outer["rows_out"] = 5
+    return {record["stage"]: record for record in memory_report}
+
+
+def test_nested_stage_peaks():
+    records = run_nested_stages([])
+    assert records["outer"]["rows_in"] == 10
+    assert records["outer"]["rows_out"] == 5
+    assert records["inner"]["rows_out"] == 2**17
+    assert records["outer"]["peak_mb"] >= 8
+    # The inner stage does not report the outer stage's running peak
+    assert 1 <= records["inner"]["peak_mb"] < 2
+    assert records["outer"]["wall_s"] >= records["inner"]["wall_s"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_nested_peaks_without_reset_peak(monkeypatch):
+    # Python < 3.9
+    monkeypatch.delattr(tracemalloc, "reset_peak")
+    records = run_nested_stages([])
+    assert records["outer"]["peak_mb"] >= 8
+    assert np.isnan(records["inner"]["peak_mb"])
+
+
+def test_no_report_is_a_no_op():
+    with memh.track_stage("stage") as record:
+        assert not tracemalloc.is_tracing()
+    assert record == {}
+
+
+def test_write_stage_report(tmp_path):
+    path = tmp_path / "reports" / "stages.jsonl"
+    records = list(run_nested_stages([]).values())
+    memh.write_stage_report(records, str(path))
+    with open(path) as f:
+        assert [json.loads(line)["stage"] for line in f] == ["inner", "outer"]
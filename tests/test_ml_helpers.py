@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.feature_utils as ut
+import src.ml_helpers as mlh
+
+
+def split_by_masks(train_end_date, gap, features):
+    "Boolean mask split, as done before binary-search splits."
+    train_mask = features["date"] <= train_end_date
+    train_fea = features[train_mask].reset_index(drop=True)
+    test_dates_mask = features["date"] >= train_end_date + pd.DateOffset(
+        days=gap + 1
+    )
+    test_fea = features[test_dates_mask].reset_index(drop=True)
+    return [
+        train_fea,
+        test_fea,
+        min(test_fea["date"]).strftime("%Y-%m-%d"),
+        max(train_fea["date"]).strftime("%Y-%m-%d"),
+        max(test_fea["date"]).strftime("%Y-%m-%d"),
+    ]
+
+
+@pytest.fixture(scope="module")
+def features(sales_grid):
+    filled, _ = ut.fill_series_gaps(sales_grid, ["sales"])
+    return ut.combine_features_vectorized(
+        filled, ["sales"], [3, 4], 7, list(filled)
+    ).dropna()
+
+
+@pytest.mark.parametrize("order", ["series", "date", "shuffled"])
+def test_train_test_gap_split_matches_masks(features, order):
+    if order == "date":
+        features = features.sort_values("date", kind="stable")
+    elif order == "shuffled":
+        features = features.sample(frac=1, random_state=0)
+    train_end_date = features["date"].max() - pd.DateOffset(days=40)
+    result = mlh.train_test_gap_split(train_end_date, 10, features)
+    expected = split_by_masks(train_end_date, 10, features)
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+    assert result[2:] == expected[2:]
+
+
+def test_align_to_keys_matches_rows_by_key(features):
+    keys = features[["store", "item", "date"]].reset_index(drop=True)
+    target = keys.sample(frac=1, random_state=0)
+    aligned = mlh.align_to_keys(features["sales"].to_numpy(), keys, target)
+    np.testing.assert_array_equal(
+        aligned, features["sales"].to_numpy()[target.index]
+    )
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.ml_metrics import smape, smape_breakdown
+
+
+@pytest.fixture(scope="module")
+def fold_predictions(sales):
+    "True sales and shuffled noisy predictions of two 20-day folds."
+    dates = sales.index.get_level_values("date")
+    y_true = sales.loc[dates > dates.max() - pd.DateOffset(days=40), "sales"]
+    folds = np.where(
+        y_true.index.get_level_values("date")
+        > dates.max() - pd.DateOffset(days=20),
+        2,
+        1,
+    )
+    rng = np.random.default_rng(0)
+    y_pred = y_true * rng.uniform(0.5, 1.5, len(y_true))
+    # Some rows where both values are zero
+    y_pred[y_true == 0] = 0
+    y_pred = y_pred.sample(frac=1, random_state=0)
+    return y_pred, y_true, folds
+
+
+def smape_by(y_pred, y_true, groups):
+    "SMAPE of every group with smape(), one group at a time."
+    preds = y_pred.reindex(y_true.index).to_numpy(dtype=float)
+    target = y_true.to_numpy(dtype=float)
+    groups = np.asarray(groups)
+    return {
+        group: smape(preds[groups == group], target[groups == group])
+        for group in np.unique(groups)
+    }
+
+
+def test_smape_breakdown_matches_per_group_smape(fold_predictions):
+    y_pred, y_true, folds = fold_predictions
+    breakdown = smape_breakdown(y_pred, y_true, folds)
+
+    preds = y_pred.reindex(y_true.index).to_numpy(dtype=float)
+    assert breakdown["overall"] == pytest.approx(
+        smape(preds, y_true.to_numpy(dtype=float))
+    )
+    expected = smape_by(
+        y_pred, y_true, y_true.index.get_level_values("symbol")
+    )
+    assert breakdown["by_series"].to_dict() == pytest.approx(expected)
+    expected = smape_by(y_pred, y_true, folds)
+    assert breakdown["by_fold"].to_dict() == pytest.approx(expected)
+    dates = y_true.index.get_level_values("date")
+    fold_start = pd.Series(dates).groupby(folds).transform("min")
+    horizon_days = (dates - pd.DatetimeIndex(fold_start)).days + 1
+    expected = smape_by(y_pred, y_true, horizon_days)
+    assert breakdown["by_horizon_day"].to_dict() == pytest.approx(expected)
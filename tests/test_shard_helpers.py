@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cv_helpers import MultiTimeSeriesDateSplit
+from src.inference_helpers import predict_future
+from src.ml_metrics import lgbm_smape
+from src.shard_helpers import score_model_from_shards
+from src.utils import score_model
+
+GAP, HORIZON = 10, 10
+MODEL_PARAMS = {
+    "metric": {"mae"},
+    "num_leaves": 8,
+    "learning_rate": 0.1,
+    "verbose": -1,
+    "nthread": 1,
+}
+FIT_PARAMS = {"num_boost_round": 20, "early_stopping_rounds": 5}
+
+
+def get_feature_args(sales):
+    return [
+        np.arange(20, 23),
+        30,
+        ["store", "item", "date", "sales"],
+        ["store", "item"],
+        sales.index.get_level_values("date").min(),
+        GAP,
+        HORIZON,
+    ]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_shard_predictions_match_in_memory(sales, tmp_path, compact):
+    args = [0, sales, *get_feature_args(sales), pd.DataFrame()]
+    args += [MODEL_PARAMS, lgbm_smape, FIT_PARAMS]
+    expected = predict_future(
+        *args, compact=compact, preprocessing="tree_native"
+    )
+    # Three series per shard, two shards
+    result = predict_future(
+        *args,
+        compact=compact,
+        preprocessing="tree_native",
+        shard_dir=tmp_path,
+        series_batch_size=3,
+    )
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    assert result[2:] == expected[2:]
+    assert os.listdir(tmp_path) == []
+
+
+def test_shard_scores_match_in_memory(sales, tmp_path):
+    cv = MultiTimeSeriesDateSplit(
+        num_folds=2, forecast_horizon=HORIZON, look_ahead_length=GAP + 1
+    )
+    args = [sales, cv, *get_feature_args(sales)]
+    args += [MODEL_PARAMS, lgbm_smape, FIT_PARAMS]
+    expected = score_model(*args, preprocessing="tree_native")
+    result = score_model_from_shards(*args, tmp_path, series_batch_size=3)
+    assert [r["smape"] for r in result] == pytest.approx(
+        [r["smape"] for r in expected]
+    )
+    for key in ["train_end_date", "test_start_date", "test_end_date"]:
+        assert [r[key] for r in result] == [r[key] for r in expected]
+    assert os.listdir(tmp_path) == []
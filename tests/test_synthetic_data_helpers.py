@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+
+from src.data_helpers import load_partitioned_parquet
+from src.synthetic_data_helpers import (
+    make_synthetic_sales,
+    write_synthetic_sales,
+)
+
+
+def test_make_synthetic_sales_layout():
+    df = make_synthetic_sales(n_stores=2, n_items=3, n_days=30, seed=1)
+    assert len(df) == 2 * 3 * 30
+    assert list(df) == ["store", "item", "sales"]
+    assert df.index.names == ["symbol", "date"]
+    # Rows ordered by store, item and date, symbols matching store and item
+    pd.testing.assert_frame_equal(
+        df, df.sort_values(["store", "item"], kind="stable")
+    )
+    assert (df.groupby(level="symbol").size() == 30).all()
+    assert (
+        df.index.get_level_values("symbol")
+        == df["store"].astype(str) + "_" + df["item"].astype(str)
+    ).all()
+    assert (df["sales"] >= 0).all()
+
+
+def test_make_synthetic_sales_is_seeded():
+    pd.testing.assert_frame_equal(
+        make_synthetic_sales(2, 3, 30, seed=1),
+        make_synthetic_sales(2, 3, 30, seed=1),
+    )
+    assert not make_synthetic_sales(2, 3, 30, seed=1).equals(
+        make_synthetic_sales(2, 3, 30, seed=2)
+    )
+
+
+def test_intermittent_series_have_zero_days():
+    df = make_synthetic_sales(2, 5, 200, intermittent_frac=1.0, zero_prob=0.5)
+    zero_share = (df["sales"] == 0).groupby(level="symbol").mean()
+    assert (zero_share > 0.3).all()
+    df = make_synthetic_sales(2, 5, 200, intermittent_frac=0.0)
+    assert (df["sales"] == 0).mean() < 0.05
+
+
+def test_write_synthetic_sales_batches_stores(tmp_path):
+    write_synthetic_sales(
+        tmp_path, n_stores=5, n_items=2, n_days=20, stores_per_batch=2
+    )
+    df = load_partitioned_parquet(tmp_path)
+    assert sorted(df["store"].unique()) == [1, 2, 3, 4, 5]
+    assert len(df) == 5 * 2 * 20
+    assert not df.duplicated(["store", "item", "date"]).any()
+    np.testing.assert_array_equal(
+        df.groupby("store").size().to_numpy(), np.full(5, 2 * 20)
+    )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+
+import numpy as np
+import pytest
+
+from src.cv_helpers import MultiTimeSeriesDateSplit
+from src.ml_metrics import LGBMSmape, LGBMTelemetry, lgbm_smape
+from src.utils import score_model
+
+GAP, HORIZON = 10, 10
+MODEL_PARAMS = {
+    "metric": {"mae"},
+    "num_leaves": 8,
+    "learning_rate": 0.1,
+    "verbose": -1,
+    "nthread": 1,
+}
+FIT_PARAMS = {"num_boost_round": 20, "early_stopping_rounds": 5}
+
+
+def get_cv(train_period_length=None):
+    return MultiTimeSeriesDateSplit(
+        num_folds=2,
+        train_period_length=train_period_length,
+        forecast_horizon=HORIZON,
+        look_ahead_length=GAP + 1,
+    )
+
+
+def run_score_model(
+    sales, cv, scoring_func=lgbm_smape, fit_params=FIT_PARAMS, **kwargs
+):
+    return score_model(
+        sales,
+        cv,
+        np.arange(20, 23),
+        30,
+        ["store", "item", "date", "sales"],
+        ["store", "item"],
+        sales.index.get_level_values("date").min(),
+        GAP,
+        HORIZON,
+        MODEL_PARAMS,
+        scoring_func,
+        fit_params,
+        **kwargs,
+    )
+
+
+def score(sales, cv, **kwargs):
+    "Helper function that returns the SMAPE of every fold of score_model()."
+    return [record["smape"] for record in run_score_model(sales, cv, **kwargs)]
+
+
+def test_features_once_matches_per_fold_scoring(sales):
+    cv = get_cv()
+    expected = score(sales, cv)
+    assert score(sales, cv, features_once=True) == pytest.approx(expected)
+    assert score(
+        sales, cv, features_once=True, check_leakage=True
+    ) == pytest.approx(expected)
+
+
+def test_features_once_rejects_sliding_windows(sales):
+    cv = get_cv(train_period_length=200)
+    assert len(score(sales, cv)) == 2
+    with pytest.raises(ValueError, match="expanding-window"):
+        score(sales, cv, features_once=True)
+
+
+def test_parallel_folds_and_features_match_serial(sales, monkeypatch):
+    cv = get_cv()
+    expected = score(sales, cv)
+    # Two fold workers with two feature workers each, even on small hosts;
+    # forked workers see the same core count
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    assert score(sales, cv, n_jobs=2, feature_n_jobs=2) == pytest.approx(
+        expected
+    )
+    assert score(sales, cv, feature_n_jobs=2) == pytest.approx(expected)
+
+
+def test_cv_audit(sales):
+    cv = get_cv()
+    expected = score(sales, cv)
+    assert score(sales, cv, cv_audit=True) == pytest.approx(expected)
+    assert score(
+        sales, cv, features_once=True, cv_audit=True
+    ) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_telemetry_in_fold_records(sales, n_jobs):
+    feval = LGBMSmape()
+    telemetry = LGBMTelemetry(feval)
+    fit_params = dict(FIT_PARAMS, callbacks=telemetry.callbacks())
+    records = run_score_model(
+        sales, get_cv(), feval, fit_params, n_jobs=n_jobs
+    )
+    for record in records:
+        iterations = [r["iteration"] for r in record["telemetry"]]
+        assert iterations == list(range(len(iterations)))
+        assert len(iterations) > 0
+        assert sum(r["metric_time"] for r in record["telemetry"]) > 0
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+
+import numpy as np
+import pytest
+
+import src.work_queue_helpers as wq
+from src.cv_helpers import MultiTimeSeriesDateSplit
+from src.ml_metrics import lgbm_smape
+
+GAP, HORIZON = 10, 10
+MODEL_PARAMS = {
+    "metric": {"mae"},
+    "num_leaves": 8,
+    "learning_rate": 0.1,
+    "verbose": -1,
+}
+FIT_PARAMS = {"num_boost_round": 20, "early_stopping_rounds": 5}
+N_FAILS = {"left": 0}
+
+
+def flaky_smape(preds, train_data):
+    "lgbm_smape() that raises N_FAILS['left'] times."
+    if N_FAILS["left"] > 0:
+        N_FAILS["left"] -= 1
+        raise ValueError("flaky metric")
+    return lgbm_smape(preds, train_data)
+
+
+def submit(queue_dir, sales, model_params, scoring_func=lgbm_smape):
+    "Helper function that submits one unit per CV fold to the queue."
+    return wq.submit_score_model_units(
+        queue_dir,
+        sales,
+        MultiTimeSeriesDateSplit(
+            num_folds=2, forecast_horizon=HORIZON, look_ahead_length=GAP + 1
+        ),
+        np.arange(20, 23),
+        30,
+        ["store", "item", "date", "sales"],
+        ["store", "item"],
+        sales.index.get_level_values("date").min(),
+        GAP,
+        HORIZON,
+        [model_params],
+        scoring_func,
+        FIT_PARAMS,
+    )
+
+
+def collect(queue_dir, unit_ids, max_attempts=3):
+    """Helper function that collects the records of unit_ids, running an
+    in-process worker on the pending units at every poll."""
+    return wq.collect_results(
+        queue_dir,
+        unit_ids,
+        heartbeat_timeout=1,
+        max_attempts=max_attempts,
+        poll_interval=0,
+        timeout=60,
+        poll_callback=lambda: wq.run_worker(
+            queue_dir, "test-worker", 1, idle_timeout=0
+        ),
+    )
+
+
+def test_requeue_after_dead_heartbeat(sales, tmp_path):
+    unit_ids = submit(tmp_path, sales, MODEL_PARAMS)
+    claimed_path = wq.claim_unit(tmp_path, "dead-worker")
+    # Last heartbeat long before the shared clock's now
+    os.utime(claimed_path, (0, 0))
+    records = collect(tmp_path, unit_ids)
+    assert [record["fold"] for record in records] == [1, 2]
+    assert os.listdir(os.path.join(tmp_path, "claimed")) == []
+
+
+def test_requeue_after_failure(sales, tmp_path):
+    unit_ids = submit(tmp_path, sales, MODEL_PARAMS, flaky_smape)
+    N_FAILS["left"] = 1
+    records = collect(tmp_path, unit_ids)
+    assert N_FAILS["left"] == 0
+    assert len(records) == 2
+    assert os.listdir(os.path.join(tmp_path, "failed")) == []
+
+
+def test_max_attempts(sales, tmp_path):
+    unit_ids = submit(tmp_path, sales, dict(MODEL_PARAMS, num_leaves=-5))
+    with pytest.raises(RuntimeError, match="failed 2 times"):
+        collect(tmp_path, unit_ids, max_attempts=2)